@@ -21,7 +21,7 @@ class DataSourceVersion(object):
         # if begins with number ('10.3')
         if isinstance(version, six.string_types):
             # catch the datetime.datetime string representations
-            if re.match('^[0-9]', version) and '___' in version and '__' in version and '_' in version:
+            if filehandler._is_datetime_dirname(version):
                 self.version = filehandler._datetime_from_dirname(version)
             # match version with '-' that are likely not dates (i.e. they do not consist of three fields)
             elif re.match('^[0-9]', version) and len(version.split('-')) != 3:
@@ -1,9 +1,15 @@
 import datetime
+import functools
 import logging
 import os
 import io
-from collections import namedtuple
-from ftplib import FTP
+import posixpath
+import random
+import shutil
+import socket
+import time
+from collections import namedtuple, OrderedDict
+from ftplib import FTP, error_temp, error_perm
 from urllib.parse import urlparse, urljoin
 from pathlib import Path
 from requests.auth import HTTPBasicAuth
@@ -18,6 +24,63 @@ from ftputil.error import FTPIOError
 
 log = logging.getLogger(__name__)
 
+# shared session, reuses connections for subsequent requests to the same host
+_SESSION = requests.Session()
+
+# maximum size of a HTML directory listing that is read into memory
+HTTP_INDEX_MAX_SIZE = 16 << 20
+
+# socket buffer size for FTP data connections and block size for binary FTP transfers
+FTP_SOCKET_BUFFER_SIZE = 4 << 20
+FTP_BLOCKSIZE = 1 << 20
+
+
+class _TunedFTP(FTP):
+    """
+    FTP client that sets larger socket buffers, TCP_NODELAY and SO_KEEPALIVE on data connections.
+
+    The OS default buffer sizes throttle transfers on connections with high latency.
+    """
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = super(_TunedFTP, self).ntransfercmd(cmd, rest)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, FTP_SOCKET_BUFFER_SIZE)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, FTP_SOCKET_BUFFER_SIZE)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        return conn, size
+
+
+# transient errors that are worth another try
+FTP_RETRY_EXCEPTIONS = (EOFError, socket.timeout, ConnectionResetError, error_temp)
+HTTP_RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+def retry(exceptions, tries=3, delay=0.5):
+    """
+    Decorator to retry a function on transient errors with jittered exponential backoff.
+
+    The last exception is raised if all tries fail.
+
+    :param exceptions: Tuple of exception types that trigger a retry.
+    :param tries: Maximum number of calls.
+    :param delay: Base delay in seconds, doubled after each failed try.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for i in range(tries):
+                try:
+                    return func(*args, **kwargs)
+                except exceptions as e:
+                    if i == tries - 1:
+                        raise
+                    wait = delay * 2 ** i + random.random() * delay
+                    log.warning(f"{func.__name__} not successful on try {i+1} ({e!r}), try again in {wait:.1f}s.")
+                    time.sleep(wait)
+        return wrapper
+    return decorator
+
 
 ##############################################################
 # download functions
@@ -94,28 +157,63 @@ def download_file(remote_url, local_file_path):
 
 
 def _download_file_http(u, path):
-    r = requests.get(u, stream=True)
+    # start with an empty file, retries in _download_file_http_resume continue a partial download
+    if os.path.exists(path):
+        os.remove(path)
+    return _download_file_http_resume(u, path)
+
+
+def _range_not_satisfiable_complete(response, offset: int) -> bool:
+    """
+    Check if a 416 response to a Range request means that the file is complete, i.e. the offset
+    is the size of the file in the Content-Range header ('bytes */<size>'). Without the header
+    the file is assumed to be complete.
+    """
+    content_range = response.headers.get('Content-Range')
+    if not content_range:
+        return True
+    size = content_range.rpartition('/')[2]
+    return size.isdigit() and int(size) == offset
+
+
+@retry(HTTP_RETRY_EXCEPTIONS)
+def _download_file_http_resume(u, path):
+    """
+    Download a file via http, continue an existing partial file with a Range request if the server supports it.
+    """
+    headers = {}
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    if offset:
+        log.debug(f"Resume download of {u} at byte {offset}")
+        headers['Range'] = f'bytes={offset}-'
+
+    with _SESSION.get(u, stream=True, headers=headers) as r:
+        # 206 partial content: append, 200: server ignored the Range header, start from scratch
+        if r.status_code == 206:
+            mode = 'ab'
+        elif r.status_code == 200:
+            mode = 'wb'
+        elif r.status_code == 416 and offset and _range_not_satisfiable_complete(r, offset):
+            # the partial file is already complete (e.g. the connection broke after the last chunk)
+            log.debug(f"Download of {u} already complete")
+            return path
+        else:
+            raise ValueError("URL can't be retrieved. Status code: {0}. URL: {1}".format(r.status_code, u))
 
-    if r.status_code == 200:
-        with open(path, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024):
+        with open(path, mode) as f:
+            for chunk in r.iter_content(chunk_size=1 << 16):
                 if chunk:
                     f.write(chunk)
-                    f.flush()
-        return path
-
-    else:
-        raise ValueError("URL can't be retrieved. Status code: {0}. URL: {1}".format(r.status_code, u))
+    return path
 
 
+@retry(FTP_RETRY_EXCEPTIONS)
 def _read_text_file_ftp(url, user=None, password=None) -> io.StringIO:
     """
     Read content of a single file from an FTP server. This returns a io.StringIO
     instance. Use only for uncompressed text files,
     does not return meaningful output for gzipped files or other binary files.
     """
-    retries = 3
-
     # add 'ftp://' to form a parsable URL in case a path is passed
     if not url.startswith("ftp://"):
         url = 'ftp://' + url
@@ -126,38 +224,27 @@ def _read_text_file_ftp(url, user=None, password=None) -> io.StringIO:
 
     log.debug("Parsed URL: {0}".format(ftp_url))
 
-    # try download n times, return if successful
-    for i in range(retries):
-        try:
-            ftp = FTP(ftp_url.netloc)
-
-            if user:
-                ftp.login(user=user, passwd=password)
-            else:
-                ftp.login()
-            log.debug(f'execute RETR on {ftp_url.path}')
-
-            output = io.StringIO()
+    output = io.StringIO()
 
-            ftp.retrlines("RETR {0}".format(ftp_url.path), output.write)
-            ftp.close()
-            return output
-
-        except EOFError as e:
-            log.error(f"Download of {ftp_url.path} not successful on try {i+1}, try again.")
-            log.error(e)
+    # the connection is also closed if a try fails
+    with _TunedFTP(ftp_url.netloc) as ftp:
+        if user:
+            ftp.login(user=user, passwd=password)
+        else:
+            ftp.login()
+        log.debug(f'execute RETR on {ftp_url.path}')
 
-    raise ValueError(f"File {ftp_url.path} not available")
+        ftp.retrlines("RETR {0}".format(ftp_url.path), output.write)
+    return output
 
 
+@retry(FTP_RETRY_EXCEPTIONS)
 def _download_file_ftp(url, filepath, user=None, pw=None):
     """
     Read content of a single file from an FTP server.
 
     Return text if possible.
     """
-    retries = 3
-
     # add 'ftp://' to form a parsable URL in case a path is passed
     if not url.startswith("ftp://"):
         url = 'ftp://' + url
@@ -169,28 +256,17 @@ def _download_file_ftp(url, filepath, user=None, pw=None):
 
     log.debug("Parsed URL: {0}".format(ftp_url))
 
-    # try download n times, return if successful
-    for i in range(retries):
-        try:
-            ftp = FTP(ftp_url.netloc)
-
-            if user:
-                ftp.login(user=user, passwd=pw)
-            else:
-                ftp.login()
-
-            with open(filepath, 'wb') as f:
-
-                ftp.retrbinary("RETR {0}".format(ftp_url.path), f.write)
-
-            ftp.close()
-            return filepath
+    # the connection is also closed if a try fails
+    with _TunedFTP(ftp_url.netloc) as ftp:
+        if user:
+            ftp.login(user=user, passwd=pw)
+        else:
+            ftp.login()
 
-        except EOFError as e:
-            log.error(f"Download of {ftp_url.path} not successful on try {i+1}, try again.")
-            log.error(e)
+        with open(filepath, 'wb') as f:
+            ftp.retrbinary("RETR {0}".format(ftp_url.path), f.write, blocksize=FTP_BLOCKSIZE)
 
-    raise ValueError(f"File {ftp_url.path} not available")
+    return filepath
 
 
 def download_directory_from_http(url, target, user=None, password=None):
@@ -199,21 +275,48 @@ def download_directory_from_http(url, target, user=None, password=None):
 
     Note that the first call *has to end with /* otherwise a file with the name of the root dir will be
     created instead of the directories.
+
+    Files are streamed to disk in binary mode, directory listings are read up to HTTP_INDEX_MAX_SIZE.
     """
     log.debug(f"Download all files from {url} to {target}")
 
-    r = requests.get(url)
-    if r.status_code != 200:
-        raise Exception('status code is {} for {}'.format(r.status_code, url))
-    content = r.text
-    if url.endswith('/'):
-        Path(target).mkdir(parents=True, exist_ok=True)
-        for link in get_links(content):
-            if not link.startswith('.'): # skip hidden files such as .DS_Store
-                download_directory_from_http(urljoin(url, link), os.path.join(target, link), user, password)
-    else:
-        with open(target, 'w') as f:
-            f.write(content)
+    with _SESSION.get(url, stream=True) as r:
+        if r.status_code != 200:
+            raise Exception('status code is {} for {}'.format(r.status_code, url))
+
+        if not url.endswith('/'):
+            # decode gzip/deflate transfer encoding, write the bytes as they are
+            r.raw.decode_content = True
+            with open(target, 'wb') as f:
+                shutil.copyfileobj(r.raw, f, length=1 << 16)
+            return
+
+        content_type = r.headers.get('Content-Type')
+        if content_type and 'html' not in content_type:
+            raise ValueError(f"Expected HTML directory listing at {url}, got Content-Type {content_type}")
+        content = _read_bounded(r, HTTP_INDEX_MAX_SIZE)
+
+    Path(target).mkdir(parents=True, exist_ok=True)
+    for link in get_links(content):
+        if not link.startswith('.'): # skip hidden files such as .DS_Store
+            download_directory_from_http(urljoin(url, link), os.path.join(target, link), user, password)
+
+
+def _read_bounded(response, max_size):
+    """
+    Read the body of a streamed response, fail if it is larger than max_size bytes.
+
+    :param response: A requests.Response opened with stream=True.
+    :param max_size: Maximum number of bytes.
+    :return: The content.
+    :rtype: bytes
+    """
+    buffer = io.BytesIO()
+    for chunk in response.iter_content(chunk_size=1 << 16):
+        buffer.write(chunk)
+        if buffer.tell() > max_size:
+            raise ValueError(f"Response from {response.url} is larger than {max_size} bytes.")
+    return buffer.getvalue()
 
 
 def download_directory_from_ftp(remote_url, source, target, user=None, password=None, overwrite=None, file_blacklist=None,
@@ -231,14 +334,10 @@ def download_directory_from_ftp(remote_url, source, target, user=None, password=
     :param overwrite:
     :return:
     """
-    if not dir_blacklist:
-        dir_blacklist = []
-
-    if not file_blacklist:
-        file_blacklist = []
-
-    if not dir_whitelist:
-        dir_whitelist = []
+    # file names are compared as a whole, directory entries are substrings of the path
+    file_blacklist = frozenset(file_blacklist or ())
+    dir_blacklist = tuple(dir_blacklist or ())
+    dir_whitelist = tuple(dir_whitelist or ())
 
     log.debug("Download directory '{0}' from '{1}' to '{2}'".format(source, remote_url, target))
     log.debug("Overwrite is {0}".format(overwrite))
@@ -272,40 +371,45 @@ def download_directory_from_ftp(remote_url, source, target, user=None, password=
             # + 1 removes the leading slash
             this_target = dirname[len(source) + 1:]
 
+            # prune blacklisted subdirectories in place so that walk() does not list them
+            # (all paths below a blacklisted directory contain the blacklisted element as well)
+            if dir_blacklist:
+                subdirs[:] = [d for d in subdirs if not any(x in posixpath.join(dirname, d) for x in dir_blacklist)]
+
             # only download if no element of dir_blacklist is in path
-            # the any() function is hard to read
-            # it iterates dir_blacklist, checks if the element is in the string 'dirname'
-            # if this is never True [= not any()] we go on
-            if not any(x in dirname for x in dir_blacklist):
-                # continue if whitelist and dirname not in whitelist
-                if dir_whitelist and any(x in dirname for x in dir_whitelist):
-                    continue
-                log.debug('Directory: {}, {}'.format(dirname, this_target))
-                this_target_dir = os.path.join(target, this_target)
-
-                if not os.path.exists(this_target_dir):
-                    os.mkdir(this_target_dir)
-
-                for f in files:
-                    if f not in file_blacklist:
-                        remote_file = os.path.join(dirname, f)
-                        local_file = os.path.join(this_target_dir, f)
-
-                        if overwrite:
-                            ftp_host.download(remote_file, local_file)
-                        else:
-                            if not os.path.isfile(local_file):
-                                try:
-                                    ftp_host.download(remote_file, local_file)
-                                except FTPIOError:
-                                    log.debug('Cannot download: {0}'.format(remote_file))
-                            else:
-                                log.debug("File exists and 'overwrite' is {0}: {1}".format(overwrite, local_file))
-                        local_files.append(local_file)
-                    else:
-                        log.debug("Skip {}".format(this_target))
-            else:
+            if any(x in dirname for x in dir_blacklist):
                 log.debug("Skip {}".format(this_target))
+                continue
+            # skip files if whitelist and dirname not in whitelist
+            # subdirectories are still visited, they can match the whitelist
+            if dir_whitelist and not any(x in dirname for x in dir_whitelist):
+                log.debug("Skip files in {}, not whitelisted".format(this_target))
+                continue
+
+            log.debug('Directory: {}, {}'.format(dirname, this_target))
+            this_target_dir = os.path.join(target, this_target)
+
+            # parents are not created if they are skipped by the whitelist
+            os.makedirs(this_target_dir, exist_ok=True)
+
+            for f in files:
+                if f not in file_blacklist:
+                    remote_file = posixpath.join(dirname, f)
+                    local_file = os.path.join(this_target_dir, f)
+
+                    if overwrite:
+                        ftp_host.download(remote_file, local_file)
+                    else:
+                        if not os.path.isfile(local_file):
+                            try:
+                                ftp_host.download(remote_file, local_file)
+                            except FTPIOError:
+                                log.debug('Cannot download: {0}'.format(remote_file))
+                        else:
+                            log.debug("File exists and 'overwrite' is {0}: {1}".format(overwrite, local_file))
+                    local_files.append(local_file)
+                else:
+                    log.debug("Skip {}".format(f))
 
     return local_files
 
@@ -355,7 +459,7 @@ def get_single_file_ftp(url, user=None, pw=None):
 
     log.debug("Parsed URL: {0}".format(ftp_url))
 
-    ftp = FTP(ftp_url.netloc)
+    ftp = _TunedFTP(ftp_url.netloc)
 
     if user:
         ftp.login(user=user, passwd=pw)
@@ -364,7 +468,7 @@ def get_single_file_ftp(url, user=None, pw=None):
 
     output = io.BytesIO()
 
-    ftp.retrbinary("RETR {0}".format(ftp_url.path), output.write)
+    ftp.retrbinary("RETR {0}".format(ftp_url.path), output.write, blocksize=FTP_BLOCKSIZE)
 
     ftp.close()
 
@@ -418,6 +522,7 @@ def list_files_only_ftp_dir(url, path=None):
     return output
 
 
+@retry(FTP_RETRY_EXCEPTIONS)
 def raw_list_ftp_dir(url, path=None, user=None, password=None):
     """
     Get the raw output of FTP LIST on an FTP path.
@@ -432,22 +537,22 @@ def raw_list_ftp_dir(url, path=None, user=None, password=None):
         url = 'ftp://' + url
 
     ftp_url = urlparse(url)
-    ftp = FTP(ftp_url.netloc)
+    filelist = []
+    # the connection is also closed if a try fails
+    with _TunedFTP(ftp_url.netloc) as ftp:
+        if user and password:
+            ftp.login(user=user, passwd=password)
+        else:
+            ftp.login()
 
-    if user and password:
-        ftp.login(user=user, passwd=password)
-    else:
-        ftp.login()
+        # move into path of url
+        if ftp_url.path:
+            ftp.cwd(ftp_url.path)
 
-    # move into path of url
-    if ftp_url.path:
-        ftp.cwd(ftp_url.path)
-
-    # additional CWD if a path is given separately
-    if path:
-        ftp.cwd(path)
-    filelist = []
-    ftp.retrlines('LIST', callback=filelist.append)
+        # additional CWD if a path is given separately
+        if path:
+            ftp.cwd(path)
+        ftp.retrlines('LIST', callback=filelist.append)
 
     return filelist
 
@@ -533,10 +638,19 @@ def latest_date_version_ftp(url, path=None):
     return max([x.date for x in ftp_files])
 
 
+# cache for file modification dates on FTP servers: (url, path, file_name) -> (timestamp, date)
+FTP_FILE_DATE_CACHE_TTL = 60
+FTP_FILE_DATE_CACHE_SIZE = 256
+_ftp_file_date_cache = OrderedDict()
+
+
 def latest_date_version_ftp_file(url, file_name, path=None):
     """
     Get the date when the file was last changed.
 
+    Uses a single MDTM command, falls back to a full directory listing if the server
+    does not support MDTM for the file. Results are cached for FTP_FILE_DATE_CACHE_TTL seconds.
+
     :param url: source URL
     :type url: str
     :param file_name: the name of the file to check
@@ -545,9 +659,61 @@ def latest_date_version_ftp_file(url, file_name, path=None):
     :type path: str
 
     :return: the last update date of the file.
-    :rtype: str
+    :rtype: datetime.date
+    """
+    key = (url, path, file_name)
+    cached = _ftp_file_date_cache.get(key)
+    if cached and time.monotonic() - cached[0] < FTP_FILE_DATE_CACHE_TTL:
+        return cached[1]
+
+    try:
+        date = _mdtm_date_ftp_file(url, file_name, path=path)
+    except error_perm as e:
+        log.debug(f"MDTM failed for {file_name} ({e}), use directory listing.")
+        date = _list_date_ftp_file(url, file_name, path=path)
+
+    _ftp_file_date_cache[key] = (time.monotonic(), date)
+    _ftp_file_date_cache.move_to_end(key)
+    while len(_ftp_file_date_cache) > FTP_FILE_DATE_CACHE_SIZE:
+        _ftp_file_date_cache.popitem(last=False)
+
+    return date
+
+
+def _mdtm_date_ftp_file(url, file_name, path=None):
     """
+    Get the modification date of a file with the MDTM command.
+
+    :return: The date modified
+    :rtype: datetime.date
+    """
+    if not url.startswith("ftp://"):
+        url = 'ftp://' + url
 
+    ftp_url = urlparse(url)
+    ftp = _TunedFTP(ftp_url.netloc)
+    ftp.login()
+
+    try:
+        if ftp_url.path:
+            ftp.cwd(ftp_url.path)
+        if path:
+            ftp.cwd(path)
+        # response looks like '213 20210304123059' (optionally with fractions of seconds)
+        response = ftp.sendcmd('MDTM ' + file_name)
+    finally:
+        ftp.close()
+
+    return datetime.datetime.strptime(response.split()[1][:14], '%Y%m%d%H%M%S').date()
+
+
+def _list_date_ftp_file(url, file_name, path=None):
+    """
+    Get the modification date of a file from a directory listing.
+
+    :return: The date modified
+    :rtype: datetime.date
+    """
     ftp_files = list_ftp_dir(url, path)
     for file in ftp_files:
         if file.name == file_name:
@@ -570,7 +736,7 @@ def latest_date_in_ftp_dir(url, path=None):
         url = 'ftp://' + url
 
     ftp_url = urlparse(url)
-    ftp = FTP(ftp_url.netloc)
+    ftp = _TunedFTP(ftp_url.netloc)
     ftp.login()
 
     # move into path of url
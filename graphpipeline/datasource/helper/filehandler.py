@@ -1,5 +1,7 @@
 import logging
 import os
+import re
+import datetime
 import subprocess
 import zipfile
 import shutil
@@ -11,6 +13,13 @@ from io import BufferedWriter
 log = logging.getLogger(__name__)
 
 
+# directory names for datetime versions, e.g. '2021-03-04T12_30_59_123456'
+DIRNAME_DATETIME_FORMAT = '%Y-%m-%dT%H_%M_%S_%f'
+_DIRNAME_DATETIME_RE = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}_\d{2}_\d{2}_\d{6}$')
+# legacy directory names created from str(datetime), e.g. '2021-03-04___12__30__59_123456'
+_LEGACY_DIRNAME_DATETIME_RE = re.compile(r'^\d{4}-\d{2}-\d{2}___\d{2}__\d{2}__\d{2}(_\d+)?$')
+
+
 def _dirname_from_datetime(some_datetime):
     """
     Create a dirname without spaces/colon/dot from a datetime.datetime
@@ -18,17 +27,31 @@ def _dirname_from_datetime(some_datetime):
     :param some_datetime: The datetime.datetime.now()
     :return: A directory name.
     """
-    return str(some_datetime).replace(' ', '___').replace(':', '__').replace('.', '_')
+    return some_datetime.strftime(DIRNAME_DATETIME_FORMAT)
+
+
+def _is_datetime_dirname(dirname):
+    """
+    Check if a directory name was created from a datetime.datetime (current or legacy format).
+
+    :param dirname: The directory name.
+    :return: True/False
+    """
+    return bool(_DIRNAME_DATETIME_RE.match(dirname) or _LEGACY_DIRNAME_DATETIME_RE.match(dirname))
 
 
 def _datetime_from_dirname(dirname):
     """
     Get the datetime.datetime from a directory name.
 
+    Directory names in the legacy format (created with replacements on str(datetime)) are still supported.
+
     :param dirname:
     :return:
     """
-    return dateutil.parser.parse(dirname.replace('___', ' ').replace('__', ':').replace('_', '.'))
+    if _LEGACY_DIRNAME_DATETIME_RE.match(dirname):
+        return dateutil.parser.parse(dirname.replace('___', ' ').replace('__', ':').replace('_', '.'))
+    return datetime.datetime.strptime(dirname, DIRNAME_DATETIME_FORMAT)
 
 
 def existing(path):
@@ -6,6 +6,8 @@
 
 """
 import logging
+import re
+import sys
 
 log = logging.getLogger(__name__)
 
@@ -14,6 +16,41 @@ log = logging.getLogger(__name__)
 # Container classes for specific EMBL like files
 ##############################################################
 
+# records end with a line starting with '//' (can have trailing blanks, e.g. '\r' of CRLF files)
+RECORD_TERMINATOR_RE = re.compile(r'\n//[^\n]*\n')
+# terminator of the last record without a newline at the end of the file
+_LAST_RECORD_TERMINATOR_RE = re.compile(r'(?:^|\n)//[^\n]*$')
+# number of characters read from the file at once when splitting records
+READ_CHUNK_SIZE = 8 << 20
+
+
+def split_records(f):
+    """
+    Yield the text of all records in an EMBL like file, without the record terminator.
+
+    The file is read in large chunks which are split on the record terminator, a partial
+    record at the end of a chunk is carried over to the next chunk. The scan for the
+    terminator runs in a compiled regular expression.
+
+    :param f: File object opened in text mode.
+    :return: Generator of record strings.
+    """
+    remainder = ''
+
+    while True:
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        parts = RECORD_TERMINATOR_RE.split(remainder + chunk)
+        remainder = parts.pop()
+        yield from parts
+
+    # the last terminator is not followed by a newline at the end of the file
+    remainder = _LAST_RECORD_TERMINATOR_RE.sub('', remainder)
+    if remainder.strip():
+        yield remainder
+
+
 class _EmblLikeFileContainer(object):
     """
     Different datasources use slightly different versions of the EMBL file format.
@@ -32,19 +69,9 @@ class _EmblLikeFileContainer(object):
         """
         Yield records of EMBL file.
         """
-        this_record = []
-
-        for l in self.f:
-
-            if l.startswith('//'):
-                yield self.SeqRecordParser(this_record).parse()
-                this_record = []
-
-            else:
-                l = l.rstrip()
-                this_record.append(l)
-
-        yield self.SeqRecordParser(this_record).parse()
+        SeqRecordParser = self.SeqRecordParser
+        for record in split_records(self.f):
+            yield SeqRecordParser(record).parse()
 
     @property
     def record_count(self):
@@ -53,10 +80,27 @@ class _EmblLikeFileContainer(object):
 
         :return: Number of records in file.
         """
+        self.f.seek(0)
+
+        # count the terminators in large chunks, read the underlying binary buffer
+        # of text files to skip decoding
+        f = getattr(self.f, 'buffer', self.f)
+        chunk = f.read(READ_CHUNK_SIZE)
+        if isinstance(chunk, bytes):
+            newline, terminator = b'\n', b'\n//'
+        else:
+            newline, terminator = '\n', '\n//'
+
         counter = 0
-        for l in self.f:
-            if l.startswith('//'):
-                counter += 1
+        # a terminator in the first line of the file is not preceded by a newline
+        tail = newline
+        while chunk:
+            chunk = tail + chunk
+            counter += chunk.count(terminator)
+            # keep the end of the chunk to find terminators spanning chunks
+            tail = chunk[-2:]
+            chunk = f.read(READ_CHUNK_SIZE)
+
         # reset file buffer position to 0
         self.f.seek(0)
 
@@ -85,7 +129,7 @@ class EMBLReaderUniProt(_EmblLikeFileContainer):
 # Sequence record parser classes
 ##############################################################
 
-def base_ID(lines):
+def base_ID(buckets):
     """
     Extract the ID and additional information from ID line. Always one line per record.
 
@@ -93,228 +137,218 @@ def base_ID(lines):
 
     ID   BN000065; SV 1; linear; genomic DNA; STD; HUM; 315242 BP.
 
-    :param lines: Lines to parse.
-    :return: ID line
+    :param buckets: Lines of the record by line ID.
+    :return: ID line, None if the record does not have exactly one ID line.
     :rtype: str
     """
-    id_lines = _get_lines_prefix(lines, 'ID')
+    id_lines = _get_lines_prefix(buckets, 'ID')
     if len(id_lines) == 1:
         # get first element of ID field, first split by ';'
         # then split by whitespace in case additional columns are delimited by multiple whitespaces
-        first_part = id_lines[0].split(';')[0].split()[0].strip()
-        return 'ID', first_part
+        first_part = id_lines[0].split(';')[0].split()
+        if first_part:
+            return 'ID', first_part[0]
+    return None
 
 
-def base_AC(lines):
+def base_AC(buckets):
     """
     Example:
     AC   P31946; A8K9K2; E1P616;
 
-    :param lines:
+    :param buckets: Lines of the record by line ID.
     :return: List of accessions.
     :rtype: list[str]
     """
-    accessions = [val.strip() for val in _merge_lines_prefix(lines, 'AC').split(';') if val]
+    accessions = [val.strip() for val in _merge_lines_prefix(buckets, 'AC').split(';') if val]
     return 'AC', accessions
 
 
-def base_OS(lines):
+def base_OS(buckets):
     """
     Example:
     OS   Homo sapiens (Human).
 
     Can be multiple lines.
 
-    :param lines: Lines to parse.
+    :param buckets: Lines of the record by line ID.
     :return:
     """
-    return 'OS', _merge_lines_prefix(lines, 'OS')
+    return 'OS', _merge_lines_prefix(buckets, 'OS')
 
 
-def base_OC(lines):
+def base_OC(buckets):
     """
     Example:
     OC   Eukaryota; Metazoa; Chordata; Craniata; Vertebrata; Euteleostomi;
     OC   Mammalia; Eutheria; Euarchontoglires; Primates; Haplorrhini;
     OC   Catarrhini; Hominidae; Homo.
 
-    :param lines: Lines to parse.
+    :param buckets: Lines of the record by line ID.
     :return: Organims classification.
     :rtype: str
     """
-    return 'OC', _merge_lines_prefix(lines, 'OC')
+    return 'OC', _merge_lines_prefix(buckets, 'OC')
 
 
-def base_DE(lines):
-    return 'DE', _merge_lines_prefix(lines, 'DE')
+def base_DE(buckets):
+    return 'DE', _merge_lines_prefix(buckets, 'DE')
 
 
-def base_DR(lines):
+def base_DR(buckets):
     """
     Example:
     DR   DNASU; 7529; -.
     DR   Ensembl; ENST00000353703; ENSP00000300161; ENSG00000166913. [P31946-1]
     DR   Ensembl; ENST00000372839; ENSP00000361930; ENSG00000166913. [P31946-1]
 
-    :param lines: Lines to parse.
+    :param buckets: Lines of the record by line ID.
     :return: Database Xrefs.
     :rtype: list[tuple]
     """
     xrefs = []
-    for l in _get_lines_prefix(lines, 'DR'):
+    for l in _get_lines_prefix(buckets, 'DR'):
         db_name, main_ref_id = _split_xref_line(l)
         xrefs.append((db_name, main_ref_id))
 
     return 'DR', xrefs
 
 
-def base_references(lines):
-    reference_blocks = []
-
-    # collect references
-    cur_ref = []
-    for l in [l for l in lines if l.startswith('R')]:
-        # RN marks beginning of new reference
-        if l.startswith('RN'):
-            # add last ref to list of refs if not the first one
-            if cur_ref:
-                reference_blocks.append(cur_ref)
-            # start new ref
-            cur_ref = []
-        # append line to collection list
-        cur_ref.append(l)
-
-    # add last element to list of refs
-    reference_blocks.append(cur_ref)
-
+def base_references(buckets):
     result_references = []
-    # process references
-    for ref_lines in reference_blocks:
+
+    # reference blocks are collected in _bucket_lines(), a block starts with RN
+    # only blocks of external references (with RX) are collected
+    for ref_block in buckets[_REFERENCE_BLOCKS]:
         ref_data = {}
 
-        # only process external references
-        if any([x.startswith('RX') for x in ref_lines]):
-            # get xrefs
-            ref_data['xref'] = []
-            for x in _get_lines_prefix(ref_lines, 'RX'):
-                ref_data['xref'].extend(_split_equal_sign_xref(x))
+        # get xrefs
+        ref_data['xref'] = []
+        for x in _get_lines_prefix(ref_block, 'RX'):
+            ref_data['xref'].extend(_split_equal_sign_xref(x))
 
-            ref_data['title'] = _merge_lines_prefix(ref_lines, 'RT')
-            ref_data['author'] = _merge_lines_prefix(ref_lines, 'RA')
-            ref_data['comment'] = _merge_lines_prefix(ref_lines, 'RC')
-            ref_data['reference'] = _merge_lines_prefix(ref_lines, 'RL')
-            ref_data['number'] = _get_lines_prefix(ref_lines, 'RN')[0].replace('[', '').replace(']', '')
+        ref_data['title'] = _merge_lines_prefix(ref_block, 'RT')
+        ref_data['author'] = _merge_lines_prefix(ref_block, 'RA')
+        ref_data['comment'] = _merge_lines_prefix(ref_block, 'RC')
+        ref_data['reference'] = _merge_lines_prefix(ref_block, 'RL')
+        ref_data['number'] = _get_lines_prefix(ref_block, 'RN')[0].replace('[', '').replace(']', '')
 
-            result_references.append(ref_data)
+        result_references.append(ref_data)
 
     return 'references', result_references
 
 
-def base_features(lines):
+def base_features(buckets):
     """
     Feature tables are different in other EMBL like file formats.
 
     This parser works with standard nucleotide EMBL format.
+
+    :param buckets: Lines of the record by line ID.
+    :return: List of features.
+    :rtype: list[dict]
     """
 
     feature_list = []
 
     # collect features
     cur_feature = []
-    for l in lines:
-        if l.startswith('FT'):
-
-            # find lines that start with a key and identify beginning of new feature
-            # other lines start with 'FT         ' (mulitple whitespaces)
-            if not l.startswith('FT         '):
-                if cur_feature:
-                    feature_list.append(cur_feature)
-                # start new feature
-                cur_feature = []
-            # append line to collection list
-            cur_feature.append(l)
+    for l in _get_lines_prefix(buckets, 'FT'):
+
+        # find lines that start with a key and identify beginning of new feature
+        # other lines are indented (the indentation of FT lines is kept in _bucket_lines())
+        if not l.startswith(' '):
+            if cur_feature:
+                feature_list.append(cur_feature)
+            # start new feature
+            cur_feature = []
+        # append line to collection list
+        # trailing whitespace is already removed in _bucket_lines()
+        cur_feature.append(l.lstrip())
 
     # add last feature
-    feature_list.append(cur_feature)
+    if cur_feature:
+        feature_list.append(cur_feature)
+
+    features = []
 
     # process features
     for f_lines in feature_list:
-        feature_data = {'qualifier': {}}
         feature_xrefs = []
 
-        full_feature_segment = _RecordSegment(f_lines)
+        # first line contains key and location, location can continue on the following lines
+        key, location = f_lines[0].split()
+        location_parts = [location]
+        # qualifier key -> list of value fragments, joined when the feature is complete
+        qualifier_parts = {}
 
-        # qualifier segment is generated from everything which is not considered a header line
-        qualifier_segment = _RecordSegment(f_lines[1:])
-
-        # iterate all lines until first qualifier is found
-        for i, l in enumerate(full_feature_segment.line_values):
-            if not l.startswith('/'):
-                # first line contains key
-                if i == 0:
-                    key, location = l.split()
-                    feature_data['key'] = key
-                    feature_data['location'] = location
-                # following lines are appended to the location
-                else:
-                    feature_data['location'] += l
-            # put everything else in qualifier segement
-            else:
-                qualifier_segment = _RecordSegment(f_lines[i:])
-                break
+        # fragments of the location or of the current qualifier
+        cur_parts = location_parts
 
-        cur_q_key = None
-
-        # process qualifiers
-        for q in qualifier_segment.line_values:
-
-            if q.startswith('/'):
-                q = q[1:]
-                q_fields = q.split('=')
-                cur_q_key = q_fields[0]
-                cur_q_value = q_fields[1].strip('"')
+        for l in f_lines[1:]:
+            if l.startswith('/'):
+                q_key, _, q_value = l[1:].partition('=')
 
                 # sub structure db xrefs
-                if cur_q_key == 'db_xref':
-                    q_xref_db, q_xref_id = cur_q_value.split(':', 1)
+                if q_key == 'db_xref':
+                    q_xref_db, q_xref_id = q_value.strip('"').split(':', 1)
                     feature_xrefs.append((q_xref_db, q_xref_id))
+                    cur_parts = None
                 else:
-                    feature_data['qualifier'][cur_q_key] = cur_q_value
+                    # qualifier keys are repeated in all features, store them only once
+                    cur_parts = qualifier_parts[sys.intern(q_key)] = [q_value]
+
+            elif cur_parts is not None:
+                cur_parts.append(l)
 
-            else:
-                if cur_q_key:
-                    feature_data['qualifier'][cur_q_key] += q
+        feature_data = {
+            'key': key,
+            'location': ''.join(location_parts),
+            'qualifier': {q_key: ''.join(parts).strip('"') for q_key, parts in qualifier_parts.items()}
+        }
 
         # add feature xrefs if existing
         if feature_xrefs:
             feature_data['xref'] = feature_xrefs
 
-        return 'features', feature_data
+        features.append(feature_data)
+
+    return 'features', features
 
 
 class _BaseSeqRecordParser(object):
-    def __init__(self, lines):
-        self.lines = lines
+    # parser functions, set by the sub classes
+    _parse_functions = ()
 
-        self.seqrecord = {}
-        self._parse_functions = []
+    def __init__(self, record):
+        """
+        :param record: The text of a single record without the terminator.
+        """
+        self.lines = record.split('\n')
+        self.buckets = _bucket_lines(self.lines)
+
+        self.seqrecord = None
 
     def parse(self):
         """
         Call all parser functions associated with this class and collect results.
         :return: The SeqenceRecord with results.
         """
+        self.seqrecord = {}
         for function in self._parse_functions:
             try:
-                key, parse_result = function(self.lines)
-                self.seqrecord[key] = parse_result
-            except ValueError:
-                log.warning('Parsing function does not return key/result. Returns: {0}'.format(
-                    function(self.lines)
-                ))
-            except TypeError:
-                log.debug('Parsing function on empty list of lines?')
+                result = function(self.buckets)
+            except Exception:
+                log.warning('Parsing function {0} failed.'.format(function.__name__), exc_info=True)
                 log.debug(self.lines)
+                continue
+
+            # parse functions return None if the record does not contain the expected lines
+            if result is None:
+                continue
+
+            key, parse_result = result
+            self.seqrecord[key] = parse_result
         return self.seqrecord
 
 
@@ -324,117 +358,96 @@ class _UniprotSequenceRecordParser(_BaseSeqRecordParser):
 
     Some fields have specific values.
     """
-
-    def __init__(self, lines):
-        super(_UniprotSequenceRecordParser, self).__init__(lines)
-
-        # collect functions for parsing
-        self._parse_functions = [
-            base_ID, base_AC, base_OS, base_OC, base_DE, base_DR, base_references
-        ]
+    _parse_functions = (
+        base_ID, base_AC, base_OS, base_OC, base_DE, base_DR, base_references
+    )
 
 
 class _RealEMBLSequenceRecordParser(_BaseSeqRecordParser):
-    def __init__(self, lines):
-        super(_RealEMBLSequenceRecordParser, self).__init__(lines)
-
-        # collect functions for parsing
-        self._parse_functions = [
-            base_ID, base_AC, base_OS, base_OC, base_DE, base_DR, base_references, base_features
-        ]
+    _parse_functions = (
+        base_ID, base_AC, base_OS, base_OC, base_DE, base_DR, base_references, base_features
+    )
 
 
 ##############################################################
 # Helper functions for parsing
 ##############################################################
 
-class _RecordSegment(object):
-    """
-    Helper class to collect some lines of a sequence record.
+# key for the reference blocks in the buckets of a record
+_REFERENCE_BLOCKS = 'references'
+# line IDs where the indentation of the content is kept (feature keys vs. qualifiers)
+_INDENTED_LINE_IDS = frozenset(['FT'])
+# interned line IDs
+_LINE_IDS = {}
 
-    Splits lines in ID and Value.
 
-    Used for operations like: Get all lines starting with "FT", run_and_merge all lines starting with "RA".
+def _bucket_lines(lines):
     """
+    Sort the lines of a record by line ID in a single pass. Remove 'XX' lines.
 
-    def __init__(self, lines):
-        self.lines = lines
-
-        self.line_tuples = _get_line_tuples(self.lines)
-
-        self.line_ids = [x[0] for x in self.line_tuples]
-        self.line_values = [x[1].strip() for x in self.line_tuples]
+    Reference lines (R*) are also grouped per reference, a reference starts with 'RN'. Each
+    reference block is a dictionary of line ID -> list of line contents as well. Only references
+    with an 'RX' line are kept.
 
-    def get(self, ref_line_id):
-        """
-        Get data for an ID. Multiple lines are returned as list.
-
-        :param ref_line_id: Line ID.
-        :return: List of lines with ID.
-        :rtype: list[str]
-        """
-        elmnts = []
-        for line_id, line_content in self.line_tuples:
-            if line_id == ref_line_id:
-                elmnts.append(line_content)
-        return elmnts
-
-    def get_one(self, ref_line_id):
-        """
-        Get content of an identifier that only occurs once in this _RecordSegment.
-
-        Else raise error.
-
-        :param ref_line_id: Line ID.
-        :return: Content of the line.
-        """
-        elmnts = self.get(ref_line_id)
+    :param lines: List of unprocessed lines.
+    :return: Dictionary of line ID -> list of line contents, reference blocks in _REFERENCE_BLOCKS.
+    :rtype: dict
+    """
+    buckets = {_REFERENCE_BLOCKS: []}
+    ref_block = None
+    ref_block_has_rx = False
 
-        if len(elmnts) > 1:
-            print(elmnts)
-            raise AttributeError("More than one line with ID {0}.".format(ref_line_id))
-        elif len(elmnts) == 1:
-            return elmnts[0]
+    for l in lines:
+        # use one string object per line ID for all records
+        line_id = l[0:2]
+        try:
+            line_id = _LINE_IDS[line_id]
+        except KeyError:
+            line_id = _LINE_IDS.setdefault(line_id, sys.intern(line_id))
+        if line_id == 'XX':
+            continue
+
+        if line_id in _INDENTED_LINE_IDS:
+            line_content = l[5:].rstrip()
         else:
-            return None
+            line_content = l[5:].strip()
 
-    def merge(self, ref_line_id, join_char=None):
-        """
-        Merge all lines with a specific line ID and return as string.
+        try:
+            buckets[line_id].append(line_content)
+        except KeyError:
+            buckets[line_id] = [line_content]
 
-        :param ref_line_id: Line ID.
-        :param join_char: Character used for joining the lines.
-        :return: Merged string of a specific line ID.
-        """
-        if not join_char:
-            join_char = ' '
+        if line_id.startswith('R'):
+            if line_id == 'RN':
+                ref_block = {}
+                ref_block_has_rx = False
+            if ref_block is not None:
+                ref_block.setdefault(line_id, []).append(line_content)
+                # only keep references with external references (RX)
+                if line_id == 'RX' and not ref_block_has_rx:
+                    buckets[_REFERENCE_BLOCKS].append(ref_block)
+                    ref_block_has_rx = True
 
-        return join_char.join(self.get(ref_line_id))
+    return buckets
 
 
-def _get_lines_prefix(lines, line_id):
+def _get_lines_prefix(buckets, line_id):
     """
     Get all lines with line ID.
 
-    :param lines: List of lines to get data.
+    :param buckets: Lines by line ID, see _bucket_lines().
     :param line_id: Line ID.
     :return: List of lines.
     :rtype: list[str]
     """
-    result = []
-    for l in lines:
-        if l.startswith(line_id):
-            _, line_content = _get_line_tuple(l)
-            result.append(line_content.strip())
+    return buckets.get(line_id, [])
 
-    return result
 
-
-def _merge_lines_prefix(lines, line_id, join_char=None):
+def _merge_lines_prefix(buckets, line_id, join_char=None):
     """
     Merge all lines beginning with a specific ID.
 
-    :param lines: Lines to parse and run_and_merge.
+    :param buckets: Lines by line ID, see _bucket_lines().
     :param line_id: Line ID to run_and_merge.
     :param join_char: Character for string join.
     :return: Joined lines.
@@ -442,36 +455,7 @@ def _merge_lines_prefix(lines, line_id, join_char=None):
     if not join_char:
         join_char = ' '
 
-    return join_char.join(
-        _get_lines_prefix(lines, line_id)
-    )
-
-
-def _get_line_tuples(list_of_lines):
-    """
-    Get line tuples for a list of lines. Remove 'XX' lines.
-
-    :param list_of_lines: List of unprocessed lines.
-    :return: List of tuples with ID and line content.
-    """
-    cleaned_lines = []
-    for l in list_of_lines:
-        if not l.startswith('XX'):
-            cleaned_lines.append(_get_line_tuple(l))
-    return cleaned_lines
-
-
-def _get_line_tuple(l):
-    """
-    Get line tuple with ID and data. Remove trailing spaces.
-
-    :param l: A line of the EMBL file.
-    :return: Line tuple.
-    """
-    l = l.rstrip()
-    line_id = l[0:2]
-    line_content = l[5:]
-    return line_id, line_content
+    return join_char.join(buckets.get(line_id, ()))
 
 
 def _split_xref_line(l):
@@ -482,21 +466,20 @@ def _split_xref_line(l):
         PUBMED; 18186931.
 
     :param l: A db xref line.
-    :return: DB identifier and first ID.
+    :return: DB identifier and list of IDs.
     """
-    l = l.strip()
-
     # there can be data after trailing '.' (comment)
     # only use part before trailing dot
     # note that some IDs contain dots, thus we only split by the LAST dot
-    l = l.rsplit('.', 1)[0]
-
-    flds = l.split(';')
+    i = l.rfind('.')
+    if i >= 0:
+        l = l[:i]
 
-    db_name = flds[0].strip()
-    ids = [x.strip() for x in flds[1:]]
+    db_name, sep, rest = l.partition(';')
+    if not sep:
+        return db_name.strip(), []
 
-    return db_name, ids
+    return db_name.strip(), [x.strip() for x in rest.split(';')]
 
 
 def _split_equal_sign_xref(l):
@@ -506,14 +489,12 @@ def _split_equal_sign_xref(l):
     PubMed=25944712; DOI=10.1002/pmic.201400617;
 
     :param l: Reference line.
-    :return:
+    :return: List of (key, value) tuples.
     """
-
     mapping_tuples = []
 
-    for entry in l.strip().split(';'):
-        entry = entry.strip()
-        flds = entry.split('=')
+    for entry in l.split(';'):
+        flds = entry.strip().split('=')
         if len(flds) == 2:
             mapping_tuples.append((flds[0], flds[1]))
     return mapping_tuples
@@ -1,8 +1,12 @@
+import functools
+import hashlib
 import importlib
+import itertools
 import logging
 import os
 import json
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List
 from datetime import date, datetime
 
 from graphio import Container, NodeSet, RelationshipSet
@@ -10,23 +14,129 @@ from py2neo import Graph
 
 from graphpipeline.datasource import DataSourceInstance
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 log = logging.getLogger(__name__)
 
+# maximum number of threads to write/read NodeSet and RelationshipSet files
+SERIALIZE_MAX_WORKERS = 8
+
+# file with the metadata of a serialized Parser
+PARSER_METADATA_FILE_NAME = 'parser_data.json'
+
+# file with the content hash of a serialized Parser, see Parser.serialize()
+PARSER_HASH_FILE_NAME = 'parser_data.hash'
+
+
+# (import path, class name) -> Parser class, see _resolve_parser()
+_PARSER_CLASS_CACHE = {}
+
+
+def _resolve_parser(import_path: str, parser_class_name: str):
+    """
+    Import a Parser class. Cached, pool workers resolve the same classes for every task.
+
+    :param import_path: Path where to import from.
+    :param parser_class_name: Name of the parser class.
+    :return: The Parser class.
+    """
+    key = (import_path, parser_class_name)
+    try:
+        return _PARSER_CLASS_CACHE[key]
+    except KeyError:
+        parser_class = _PARSER_CLASS_CACHE[key] = getattr(importlib.import_module(import_path), parser_class_name)
+        return parser_class
+
+
+# Graph of a pool worker process, set in _init_worker()
+_WORKER_GRAPH = None
+
+
+def _init_worker(graph_config: tuple, max_connection_pool_size: int = None):
+    """
+    Initializer for pool worker processes. Create one Graph per worker that is reused by all tasks
+    of the worker instead of connecting for every task.
+
+    :param graph_config: Tuple of graph profile and graph name.
+    :param max_connection_pool_size: Maximum number of Bolt connections of the worker.
+    """
+    global _WORKER_GRAPH
+    settings = {}
+    if max_connection_pool_size:
+        settings['max_size'] = max_connection_pool_size
+    _WORKER_GRAPH = Graph(graph_config[0], name=graph_config[1], **settings)
+
+
+def add_nodes(nodeset: NodeSet, nodes: Iterable[dict]):
+    """
+    Add many nodes to a NodeSet at once. The node dictionaries are appended with one list.extend()
+    instead of one NodeSet.add_node() call per node. NodeSets with default properties or a node
+    index fall back to NodeSet.add_node().
+
+    :param nodeset: The NodeSet.
+    :param nodes: Iterable of node property dictionaries.
+    """
+    if nodeset.default_props or nodeset.indexed:
+        for properties in nodes:
+            nodeset.add_node(properties)
+    else:
+        nodeset.nodes.extend(nodes)
+
+
+def add_relationships(relset: RelationshipSet, relationships: Iterable[tuple]):
+    """
+    Add many relationships to a RelationshipSet at once, see add_nodes().
+
+    :param relset: The RelationshipSet.
+    :param relationships: Iterable of (start node properties, end node properties, properties) tuples.
+    """
+    if relset.default_props or getattr(relset, 'unique', False):
+        for start_node_properties, end_node_properties, properties in relationships:
+            relset.add_relationship(start_node_properties, end_node_properties, properties)
+    else:
+        relset.relationships.extend(
+            (start_node_properties, end_node_properties, properties or {})
+            for start_node_properties, end_node_properties, properties in relationships
+        )
+
+
+def _skip_empty(object_sets: list) -> list:
+    """
+    Remove NodeSets/RelationshipSets without data, avoids database round-trips for empty sets.
+
+    Nodes/relationships which are not a list (e.g. generators of a YieldParser) are kept.
+    """
+    result = []
+    for object_set in object_sets:
+        objects = object_set.relationships if isinstance(object_set, RelationshipSet) else object_set.nodes
+        if isinstance(objects, list) and not objects:
+            log.debug("Skip empty %s", object_set)
+        else:
+            result.append(object_set)
+    return result
+
 
 def run_parser_merge_nodes(graph_config: tuple, parser_class_name: str, import_path: str, parser_arguments: dict, datasourceinstances: List[dict], root_dir: str):
     """
     Run a parser in a Pool/RPC.
 
+    :param graph_config: Tuple of graph profile and graph name, can be None if the worker was
+        initialized with _init_worker().
     :param parser_class_name: Name of the parser class.
     :param import_path: Path where to import from.
     :param parser_arguments: Arguments for the parser.
     :param datasourceinstance_dict: serialized DataSourceInstance
     """
 
-    graph = Graph(graph_config[0], name=graph_config[1])
+    # use the Graph of the worker if the pool was initialized with _init_worker()
+    graph = _WORKER_GRAPH
+    if graph is None:
+        graph = Graph(graph_config[0], name=graph_config[1])
 
-    module = importlib.import_module(import_path)
-    parser_class = getattr(module, parser_class_name)
+    parser_class = _resolve_parser(import_path, parser_class_name)
 
     parser = parser_class()
     # add datasource instances
@@ -35,12 +145,14 @@ def run_parser_merge_nodes(graph_config: tuple, parser_class_name: str, import_p
         parser.datasource_instances.append(dsi)
     # add arguments
     for k, v in parser_arguments.items():
-        parser.__dict__[k] = v
+        setattr(parser, k, v)
 
     parser.run_with_mounted_arguments()
 
-    for ns in parser.container.nodesets:
-        ns.create_index(graph)
+    # the container is cached on the parser, build it once after the parser ran
+    nodesets = _skip_empty(parser.container.nodesets)
+    parser._create_indexes(graph, nodesets, [])
+    for ns in nodesets:
         ns.merge(graph)
 
 
@@ -56,9 +168,8 @@ def run_and_serialize(target_dir: str, parser_class_name: str, import_path: str,
     :param root_dir:
     :return:
     """
-    log.debug(f"Run {parser_class_name} with {parser_arguments}")
-    module = importlib.import_module(import_path)
-    parser_class = getattr(module, parser_class_name)
+    log.debug("Run %s with %s", parser_class_name, parser_arguments)
+    parser_class = _resolve_parser(import_path, parser_class_name)
 
     parser = parser_class()
     # add datasource instances
@@ -67,13 +178,134 @@ def run_and_serialize(target_dir: str, parser_class_name: str, import_path: str,
         parser.datasource_instances.append(dsi)
     # add arguments
     for k, v in parser_arguments.items():
-        parser.__dict__[k] = v
+        setattr(parser, k, v)
 
     parser.run_with_mounted_arguments()
 
     parser.serialize(target_dir)
 
 
+def _json_serial(obj):
+    # serializer for datetime
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError("Type %s not serializable" % type(obj))
+
+
+def _dumps(data) -> bytes:
+    """
+    Serialize data to JSON bytes. Use orjson if available, stdlib json otherwise.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_serial,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, default=_json_serial).encode('utf-8')
+
+
+def _loads(data: bytes):
+    """
+    Deserialize JSON bytes. Use orjson if available, stdlib json otherwise.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dump_json(data, path: str):
+    """
+    Write data to a JSON file. Use orjson if available, stdlib json otherwise.
+    """
+    with open(path, 'wb') as f:
+        f.write(_dumps(data))
+
+
+def _load_json(path: str):
+    """
+    Read a JSON file. Use orjson if available, stdlib json otherwise.
+    """
+    with open(path, 'rb') as f:
+        return _loads(f.read())
+
+
+# number of nodes/relationships per line of a serialized NodeSet/RelationshipSet
+SERIALIZE_CHUNK_SIZE = 10000
+
+# suffix of the newline delimited JSON files of NodeSets/RelationshipSets, see _write_object_set()
+OBJECT_SET_FILE_SUFFIX = '.ndjson'
+# suffix of NodeSet/RelationshipSet files with one JSON document (NodeSet.serialize(), older versions)
+LEGACY_OBJECT_SET_FILE_SUFFIX = '.json'
+
+
+def _object_set_data_key(object_set) -> str:
+    return 'relationships' if isinstance(object_set, RelationshipSet) else 'nodes'
+
+
+def _object_set_lines(object_set):
+    """
+    Encode a NodeSet or RelationshipSet as newline delimited JSON, see _write_object_set().
+
+    :param object_set: NodeSet or RelationshipSet.
+    :return: Generator of lines (bytes).
+    """
+    # to_dict() references the nodes/relationships list, it is not copied
+    header = object_set.to_dict()
+    objects = iter(header.pop(_object_set_data_key(object_set)))
+
+    yield _dumps(header) + b'\n'
+    chunk = list(itertools.islice(objects, SERIALIZE_CHUNK_SIZE))
+    while chunk:
+        yield _dumps(chunk) + b'\n'
+        chunk = list(itertools.islice(objects, SERIALIZE_CHUNK_SIZE))
+
+
+def _write_object_set(object_set, target_dir: str):
+    """
+    Write a NodeSet or RelationshipSet to a newline delimited JSON file (OBJECT_SET_FILE_SUFFIX)
+    in a target directory.
+
+    The first line is the header from to_dict() without the nodes/relationships, each following
+    line is a JSON array with up to SERIALIZE_CHUNK_SIZE nodes/relationships. Only one chunk is
+    encoded at a time instead of the whole set, nodes/relationships can also be a generator.
+
+    :param object_set: NodeSet or RelationshipSet.
+    :param target_dir: Target directory.
+    """
+    path = os.path.join(target_dir, object_set.object_file_name(suffix=OBJECT_SET_FILE_SUFFIX))
+    with open(path, 'wb') as f:
+        f.writelines(_object_set_lines(object_set))
+
+
+def _read_object_set(path: str, object_set_class):
+    """
+    Read a serialized NodeSet or RelationshipSet.
+
+    Reads the newline delimited files of _write_object_set() as well as '.json' files with a single
+    JSON document (NodeSet.serialize()/RelationshipSet.serialize(), older versions).
+
+    :param path: Path to the file.
+    :param object_set_class: NodeSet or RelationshipSet.
+    :return: The NodeSet or RelationshipSet.
+    """
+    log.debug("Deserialize %s", path)
+    if path.endswith(OBJECT_SET_FILE_SUFFIX):
+        data_key = 'relationships' if issubclass(object_set_class, RelationshipSet) else 'nodes'
+        with open(path, 'rb') as f:
+            data = _loads(f.readline())
+            objects = []
+            for line in f:
+                if line.strip():
+                    objects.extend(_loads(line))
+        data[data_key] = objects
+    else:
+        data = _load_json(path)
+    object_set = object_set_class.from_dict(data)
+    if isinstance(object_set, NodeSet):
+        log.debug("Num nodes in NodeSet: %d", len(object_set.nodes))
+    else:
+        log.debug("Num relationships in RelationshipSet: %d", len(object_set.relationships))
+    return object_set
+
+
 class Parser:
 
     def __init__(self):
@@ -87,10 +319,8 @@ class Parser:
         """
         Return a dictionary of Parser run arguments.
         """
-        parser_arguments = {}
-        for k in self.arguments:
-            parser_arguments[k] = self.__dict__[k]
-        return parser_arguments
+        parser_dict = self.__dict__
+        return {k: parser_dict[k] for k in self.arguments}
 
     def get_instance_by_name(self, name):
         """
@@ -106,29 +336,69 @@ class Parser:
     def get_nodeset(self, labels, merge_keys):
         return self.container.get_nodeset(labels, merge_keys)
 
-    @property
+    def __setattr__(self, key, value):
+        # register NodeSets/RelationshipSets by attribute name, a new set has to show up in the container
+        object_sets = self.__dict__.setdefault('_object_sets', {})
+        if isinstance(value, (NodeSet, RelationshipSet)):
+            object_sets[key] = value
+            self._invalidate_container()
+        elif key in object_sets:
+            del object_sets[key]
+            self._invalidate_container()
+        super(Parser, self).__setattr__(key, value)
+
+    def __delattr__(self, key):
+        if key in self.__dict__.get('_object_sets', {}):
+            del self._object_sets[key]
+            self._invalidate_container()
+        super(Parser, self).__delattr__(key)
+
+    @functools.cached_property
     def container(self):
-        container = Container()
-        for k, o in self.__dict__.items():
-            if isinstance(o, NodeSet) or isinstance(o, RelationshipSet):
-                container.add(o)
-        return container
-
-    def merge(self, graph):
-        for nodeset in self.container.nodesets:
-            nodeset.create_index(graph)
-            nodeset.merge(graph)
-        for relset in self.container.relationshipsets:
-            relset.create_index(graph)
-            relset.merge(graph)
+        """
+        Container with all NodeSets and RelationshipSets of the Parser. Built on first access and
+        cached. Only sets assigned as attributes are registered (see __setattr__).
+        """
+        return Container(self.__dict__.get('_object_sets', {}).values())
+
+    def _invalidate_container(self):
+        """
+        Drop the cached container, it is rebuilt on next access.
+        """
+        self.__dict__.pop('container', None)
 
-    def create(self, graph):
-        for nodeset in self.container.nodesets:
+    def _create_indexes(self, graph, nodesets, relsets):
+        """
+        Create the indexes for all NodeSets and RelationshipSets before any data is loaded.
+        """
+        for nodeset in nodesets:
             nodeset.create_index(graph)
-            nodeset.create(graph)
-        for relset in self.container.relationshipsets:
+        for relset in relsets:
             relset.create_index(graph)
-            relset.create(graph)
+
+    def merge(self, graph, batch_size: int = None):
+        container = self.container
+        nodesets = _skip_empty(container.nodesets)
+        relsets = _skip_empty(container.relationshipsets)
+
+        self._create_indexes(graph, nodesets, relsets)
+
+        for nodeset in nodesets:
+            nodeset.merge(graph, batch_size=batch_size)
+        for relset in relsets:
+            relset.merge(graph, batch_size=batch_size)
+
+    def create(self, graph, batch_size: int = None):
+        container = self.container
+        nodesets = _skip_empty(container.nodesets)
+        relsets = _skip_empty(container.relationshipsets)
+
+        self._create_indexes(graph, nodesets, relsets)
+
+        for nodeset in nodesets:
+            nodeset.create(graph, batch_size=batch_size)
+        for relset in relsets:
+            relset.create(graph, batch_size=batch_size)
 
     def run_with_mounted_arguments(self):
         """
@@ -175,46 +445,85 @@ class Parser:
 
         return output
 
-    def serialize(self, target_dir: str, overwrite: bool = True):
+    def _content_hash(self, object_sets: list) -> str:
+        """
+        Hash of the metadata and the encoded NodeSets and RelationshipSets of the Parser.
+        """
+        content_hash = hashlib.blake2b()
+        content_hash.update(_dumps(self.metadata_dict()))
+        for object_set in object_sets:
+            content_hash.update(object_set.object_file_name(suffix=OBJECT_SET_FILE_SUFFIX).encode('utf-8'))
+            for line in _object_set_lines(object_set):
+                content_hash.update(line)
+        return content_hash.hexdigest()
+
+    def serialize(self, target_dir: str, overwrite: bool = True, skip_unchanged: bool = False):
         """
         Store the Parser with output in a directory.
 
         Default behaviour is to delete existing nodeset/relationship set files in the target directory.
+
+        With skip_unchanged a content hash is stored with the files. Nothing is written if the Parser
+        was serialized to the directory before with the same content. NodeSets/RelationshipSets
+        with data which is not a list (e.g. generators of a YieldParser) are always written.
+
+        :param target_dir: Target directory.
+        :param overwrite: Delete existing files of the Parser in the target directory.
+        :param skip_unchanged: Do not write anything if the content did not change.
         """
 
-        # serializer for datetime
         serialization_dir_name = self._serialization_dir_name()
         log.debug(f"Serialize {self.__class__.__name__} to {target_dir}/{serialization_dir_name}. Overwrite is {overwrite}.")
 
-        def json_serial(obj):
-            if isinstance(obj, (datetime, date)):
-                return obj.isoformat()
-            raise TypeError("Type %s not serializable" % type(obj))
-
         output_dir = os.path.join(target_dir, serialization_dir_name)
+        hash_path = os.path.join(output_dir, PARSER_HASH_FILE_NAME)
+
+        container = self.container
+        object_sets = container.nodesets + container.relationshipsets
+
+        content_hash = None
+        if skip_unchanged and all(isinstance(o.nodes if isinstance(o, NodeSet) else o.relationships, list)
+                                  for o in object_sets):
+            content_hash = self._content_hash(object_sets)
+            try:
+                with open(hash_path, 'rt') as f:
+                    unchanged = f.read() == content_hash
+            except FileNotFoundError:
+                unchanged = False
+            if unchanged and all(os.path.exists(os.path.join(output_dir, o.object_file_name(suffix=OBJECT_SET_FILE_SUFFIX)))
+                                 for o in object_sets):
+                log.debug("%s did not change, skip serialization", self.__class__.__name__)
+                return
+
         # clean output directory
         if overwrite:
             if os.path.exists(output_dir):
-                for f in os.listdir(output_dir):
-                    if f.startswith('nodeset_') and f.endswith('.json'):
-                        os.remove(os.path.join(output_dir, f))
-                    if f.startswith('relationshipset_') and f.endswith('.json'):
-                        os.remove(os.path.join(output_dir, f))
-                    if f == 'parser_data.json':
-                        os.remove(os.path.join(output_dir, f))
+                with os.scandir(output_dir) as entries:
+                    for entry in entries:
+                        name = entry.name
+                        if name == PARSER_METADATA_FILE_NAME or (
+                                name.endswith((OBJECT_SET_FILE_SUFFIX, LEGACY_OBJECT_SET_FILE_SUFFIX))
+                                and name.startswith(('nodeset_', 'relationshipset_'))):
+                            os.remove(entry.path)
 
         if not os.path.exists(output_dir):
             os.mkdir(output_dir)
+        elif os.path.exists(hash_path):
+            # the files are rewritten, the old hash is not valid anymore
+            os.remove(hash_path)
 
-        metadate_path = os.path.join(output_dir, 'parser_data.json')
-        with open(metadate_path, 'wt') as f:
-            json.dump(self.metadata_dict(), f, default=json_serial)
+        metadate_path = os.path.join(output_dir, PARSER_METADATA_FILE_NAME)
+        _dump_json(self.metadata_dict(), metadate_path)
 
-        for nodeset in self.container.nodesets:
-            nodeset.serialize(output_dir)
+        if object_sets:
+            with ThreadPoolExecutor(max_workers=min(SERIALIZE_MAX_WORKERS, len(object_sets))) as executor:
+                # consume the results to raise exceptions from the threads
+                list(executor.map(lambda object_set: _write_object_set(object_set, output_dir), object_sets))
 
-        for relset in self.container.relationshipsets:
-            relset.serialize(output_dir)
+        # write the hash last, an interrupted serialization is not skipped next time
+        if content_hash is not None:
+            with open(hash_path, 'wt') as f:
+                f.write(content_hash)
 
     @classmethod
     def deserialize(cls, source_dir: str, metadata_only: bool = False) -> 'Parser':
@@ -227,29 +536,30 @@ class Parser:
         log.debug(f"Read Parser from {source_dir}.")
         p = cls()
 
-        for file in os.listdir(source_dir):
-            if not metadata_only:
-                if file.startswith('nodeset_'):
-                    ns_name = file.replace('.json', '')
-                    with open(os.path.join(source_dir, file), 'rt') as f:
-                        log.debug(f"Deserialize {f}")
-                        ns = NodeSet.from_dict(json.load(f))
-                        log.debug(f"Num nodes in NodeSet: {len(ns.nodes)}")
-                        p.__dict__[ns_name] = ns
-
-                elif file.startswith('relationshipset_'):
-                    rs_name = file.replace('.json', '')
-                    with open(os.path.join(source_dir, file), 'rt') as f:
-                        log.debug(f"Deserialize {f}")
-                        rs = RelationshipSet.from_dict(json.load(f))
-                        log.debug(f"Num relationships in RelationshipSet: {len(rs.relationships)}")
-                        p.__dict__[rs_name] = rs
-
-            if file == 'parser_data.json':
-                with open(os.path.join(source_dir, file), 'rt') as f:
-                    metadata = json.load(f)
+        # files with NodeSets and RelationshipSets, read in threads
+        object_set_files = []
+
+        with os.scandir(source_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if name == PARSER_METADATA_FILE_NAME:
+                    metadata = _load_json(entry.path)
                     # TODO add datasource instances to deserializer
                     p.name = metadata['name']
+                elif not metadata_only and name.endswith((OBJECT_SET_FILE_SUFFIX, LEGACY_OBJECT_SET_FILE_SUFFIX)):
+                    if name.startswith('nodeset_'):
+                        object_set_files.append((name, entry.path, NodeSet))
+                    elif name.startswith('relationshipset_'):
+                        object_set_files.append((name, entry.path, RelationshipSet))
+
+        if object_set_files:
+            with ThreadPoolExecutor(max_workers=min(SERIALIZE_MAX_WORKERS, len(object_set_files))) as executor:
+                object_sets = executor.map(
+                    lambda name_path_class: _read_object_set(name_path_class[1], name_path_class[2]),
+                    object_set_files
+                )
+                for (name, _, _), object_set in zip(object_set_files, object_sets):
+                    setattr(p, os.path.splitext(name)[0], object_set)
 
         return p
 
@@ -265,30 +575,22 @@ class ReturnParser(Parser):
     def __init__(self):
         super(ReturnParser, self).__init__()
 
-    @property
-    def container(self):
-        container = Container()
-        for k, o in self.__dict__.items():
-            if isinstance(o, NodeSet) or isinstance(o, RelationshipSet):
-                container.add(o)
-        return container
-
     def _reset_parser(self):
         """
         Delete all NodeSets and RelationshipSets to free up memory in data loading pipelines.
         """
         log.info("Reset Parser {}".format(self.__class__.__name__))
 
-        for k, o in self.__dict__.items():
+        for k, o in self.__dict__.get('_object_sets', {}).items():
             if isinstance(o, NodeSet):
                 log.info("Delete nodes for NodeSet with key {}".format(k))
-                del o.nodes
                 o.nodes = []
-            elif isinstance(o, RelationshipSet):
+            else:
                 log.info("Delete relationships for RelationshipSet with key {}".format(k))
-                del o.relationships
                 o.relationships = []
 
+        # the container is still valid, the NodeSets and RelationshipSets are the same objects
+
 
 class YieldParser(Parser):
     """
@@ -300,3 +602,9 @@ class YieldParser(Parser):
 
     def __init__(self):
         super(YieldParser, self).__init__()
+
+    def _reset_parser(self):
+        """
+        Nothing to free, the ObjectSets hold generators and no data.
+        """
+        pass
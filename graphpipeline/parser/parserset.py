@@ -1,27 +1,530 @@
-from py2neo import Graph
-from multiprocessing import Pool
+from py2neo import Graph, ClientError, TransientError
+from neo4j import Driver, GraphDatabase
+from neo4j.exceptions import ClientError as DriverClientError, TransientError as DriverTransientError
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import contextlib
+import copy
+import functools
 import logging
 import os
+import pickle
+import queue
+import random
+import tempfile
+import threading
+import time
 
-from typing import List, Union
+from typing import Iterable, List, Union
+
+from graphio import RelationshipSet
+from graphio.graph import run_query_return_results
 
 from graphpipeline.parser import Parser
-from graphpipeline.parser.parser import run_parser_merge_nodes, run_and_serialize
+from graphpipeline.parser.parser import run_parser_merge_nodes, run_and_serialize, _init_worker, \
+    _load_json, _skip_empty, PARSER_METADATA_FILE_NAME
 
 log = logging.getLogger(__name__)
 
+# number of parsers waiting for their NodeSets to be merged in run_and_merge_sequential()
+MERGE_QUEUE_SIZE = 2
+
+# number of retries of a RelationshipSet bin after a transient error (e.g. a deadlock)
+MERGE_RETRIES = 3
+# base delay in seconds before a retry, doubled after each try and jittered so that bins do not collide again
+MERGE_RETRY_DELAY = 0.5
+
+
+def _object_set_labels(object_set) -> set:
+    """
+    Labels of the nodes written when loading a NodeSet or RelationshipSet.
+    """
+    if isinstance(object_set, RelationshipSet):
+        return set(object_set.start_node_labels) | set(object_set.end_node_labels)
+    return set(object_set.labels)
+
+
+def _group_by_labels(object_sets: list) -> List[list]:
+    """
+    Group NodeSets/RelationshipSets which write nodes with common labels. Sets in different groups
+    do not touch the same nodes and can be loaded concurrently.
+
+    :param object_sets: List of NodeSets/RelationshipSets.
+    :return: List of groups, each a list of NodeSets/RelationshipSets in the original order.
+    """
+    groups = []
+    for object_set in object_sets:
+        labels = _object_set_labels(object_set)
+        members = [object_set]
+        other_groups = []
+        for group_labels, group_members in groups:
+            if group_labels & labels:
+                labels = labels | group_labels
+                members = group_members + members
+            else:
+                other_groups.append((group_labels, group_members))
+        other_groups.append((labels, members))
+        groups = other_groups
+
+    order = {id(object_set): i for i, object_set in enumerate(object_sets)}
+    return [sorted(members, key=lambda o: order[id(o)]) for _, members in groups]
+
+
+def _graph_key(graph: Union[Graph, Driver]) -> tuple:
+    """
+    Key to identify the database of a py2neo.Graph or neo4j.Driver.
+    """
+    if isinstance(graph, Driver):
+        return 'driver', id(graph)
+    return str(graph.service.profile), graph.name
+
+
+def _thread_graph(graph: Union[Graph, Driver], graph_settings: dict = None) -> Union[Graph, Driver]:
+    """
+    Connection for another thread. A py2neo.Graph is not thread-safe, a new Graph with the same
+    profile is created. A neo4j.Driver is thread-safe and pools its connections, it is shared.
+
+    :param graph: py2neo.Graph or neo4j.Driver
+    :param graph_settings: Additional settings for a new Graph (e.g. connection pool size).
+    """
+    if isinstance(graph, Driver):
+        return graph
+    return Graph(graph.service.profile, name=graph.name, **(graph_settings or {}))
+
+
+def _load_object_sets(graph: Union[Graph, Driver], object_sets: list, load, max_workers: int = None,
+                      graph_settings: dict = None, group_by_labels: bool = True):
+    """
+    Call load(object_set, graph) for all NodeSets/RelationshipSets.
+
+    With max_workers > 1 groups of sets without common labels (see _group_by_labels()) are loaded
+    concurrently in threads, each thread uses its own Graph.
+
+    :param graph: py2neo.Graph or neo4j.Driver
+    :param object_sets: List of NodeSets/RelationshipSets.
+    :param load: Function to load one set.
+    :param max_workers: Maximum number of threads.
+    :param graph_settings: Additional settings for the Graphs of the threads (e.g. connection pool size).
+    :param group_by_labels: Group sets with common labels, if False all sets are loaded concurrently.
+    """
+    if not max_workers or max_workers < 2:
+        for object_set in object_sets:
+            load(object_set, graph)
+        return
+
+    if group_by_labels:
+        groups = _group_by_labels(object_sets)
+    else:
+        groups = [[object_set] for object_set in object_sets]
+    if not groups:
+        return
+
+    thread_data = threading.local()
+
+    def load_group(group):
+        thread_graph = getattr(thread_data, 'graph', None)
+        if thread_graph is None:
+            thread_graph = thread_data.graph = _thread_graph(graph, graph_settings)
+        for object_set in group:
+            load(object_set, thread_graph)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(groups))) as executor:
+        futures = [executor.submit(load_group, group) for group in groups]
+        for future in as_completed(futures):
+            # raise exceptions from the threads
+            future.result()
+
+
+# queries to check if a procedure exists, Neo4j 4.3+ and older versions
+PROCEDURE_CHECK_QUERIES = (
+    "SHOW PROCEDURES YIELD name WHERE name = $name RETURN count(name) AS count",
+    "CALL dbms.procedures() YIELD name WHERE name = $name RETURN count(name) AS count"
+)
+
+
+def _apoc_available(graph: Graph) -> bool:
+    """
+    Check if apoc.periodic.iterate is installed.
+
+    :param graph: py2neo.Graph or neo4j.Driver
+    """
+    for query in PROCEDURE_CHECK_QUERIES:
+        try:
+            return run_query_return_results(graph, query, name='apoc.periodic.iterate')[0]['count'] > 0
+        except (ClientError, DriverClientError):
+            continue
+    return False
+
+
+# maximum number of rows sent with one apoc.periodic.iterate query, see ParserSet.merge_nodes_apoc()
+APOC_MERGE_CHUNK_SIZE = 100000
+
+
+def _merge_key(properties: dict, keys: List[str]):
+    """
+    Hashable key of the values of the merge keys (or start/end node properties) of a node.
+    Unhashable values (e.g. lists) are compared by their repr().
+    """
+    key = tuple(properties.get(k) for k in keys)
+    try:
+        hash(key)
+    except TypeError:
+        key = repr(key)
+    return key
+
+
+def _unique_node_rows(nodeset) -> list:
+    """
+    Properties of the nodes of a NodeSet with one row per merge key. Properties of nodes with the
+    same merge key are combined in order, same result as merging the nodes one after another.
+
+    :param nodeset: The NodeSet.
+    :return: List of property dictionaries.
+    """
+    rows = {}
+    for properties in nodeset.node_properties():
+        key = _merge_key(properties, nodeset.merge_keys)
+        row = rows.get(key)
+        if row is None:
+            rows[key] = properties
+        else:
+            row.update(properties)
+    return list(rows.values())
+
+
+# (labels, merge keys) -> query, see _apoc_merge_nodes_query()
+_APOC_MERGE_NODES_QUERIES = {}
+
+
+def _apoc_merge_nodes_query(labels: List[str], merge_keys: List[str]) -> str:
+    """
+    Query to merge nodes passed as parameter $rows with apoc.periodic.iterate. Same MERGE as in
+    NodeSet.merge(), the batches run in parallel on the server.
+
+    Cached, the query is built once per combination of labels and merge keys.
+
+    :param labels: Labels of the nodes.
+    :param merge_keys: Properties to merge on.
+    :return: The query.
+    """
+    key = (tuple(labels), tuple(merge_keys))
+    try:
+        return _APOC_MERGE_NODES_QUERIES[key]
+    except KeyError:
+        pass
+    label_string = ':'.join(labels)
+    merge_string = ', '.join(f"{k}: row.{k}" for k in merge_keys)
+    query = _APOC_MERGE_NODES_QUERIES[key] = (
+        "CALL apoc.periodic.iterate("
+        "'UNWIND $rows AS row RETURN row', "
+        f"'MERGE (n:{label_string} {{ {merge_string} }}) ON CREATE SET n = row ON MATCH SET n += row', "
+        "{batchSize: $batch_size, parallel: true, concurrency: $concurrency, params: {rows: $rows}}"
+        ") YIELD failedBatches, errorMessages "
+        "RETURN failedBatches, errorMessages"
+    )
+    return query
+
+
+def _datasource_instance_dicts(parser: Parser, cache: dict) -> List[dict]:
+    """
+    Serialize the DataSourceInstances of a parser. DataSourceInstances shared by several parsers
+    are serialized only once.
+
+    :param parser: The Parser.
+    :param cache: Dictionary id(DataSourceInstance) -> serialized DataSourceInstance.
+    :return: List of serialized DataSourceInstances.
+    """
+    dsi_dicts = []
+    for dsi in parser.datasource_instances:
+        try:
+            dsi_dict = cache[id(dsi)]
+        except KeyError:
+            dsi_dict = cache[id(dsi)] = dsi.to_dict()
+        dsi_dicts.append(dsi_dict)
+    return dsi_dicts
+
+
+def _combine_key(object_set) -> tuple:
+    """
+    Key of NodeSets/RelationshipSets which are loaded with the same query and batch size.
+    """
+    if isinstance(object_set, RelationshipSet):
+        return (
+            'relationshipset', object_set.rel_type,
+            tuple(object_set.start_node_labels), tuple(object_set.start_node_properties),
+            tuple(object_set.end_node_labels), tuple(object_set.end_node_properties),
+            object_set.batch_size
+        )
+    return (
+        'nodeset', tuple(object_set.labels), tuple(object_set.merge_keys or ()),
+        tuple(object_set.preserve or ()), tuple(object_set.append_props or ()),
+        object_set.batch_size
+    )
+
+
+def _combine_object_sets(object_sets: list) -> list:
+    """
+    Combine NodeSets/RelationshipSets of different parsers which are loaded with the same query
+    (e.g. same labels and merge keys) into one set. Batches are filled across the parsers and
+    there is only one partial batch per query.
+
+    Sets with nodes/relationships which are not a list (e.g. generators of a YieldParser) are
+    not combined. The original sets are not changed.
+
+    :param object_sets: List of NodeSets/RelationshipSets.
+    :return: List of NodeSets/RelationshipSets in the order of the first set of each group.
+    """
+    groups = {}
+    for object_set in object_sets:
+        objects = object_set.relationships if isinstance(object_set, RelationshipSet) else object_set.nodes
+        key = _combine_key(object_set) if isinstance(objects, list) else id(object_set)
+        groups.setdefault(key, []).append(object_set)
+
+    result = []
+    for group in groups.values():
+        if len(group) == 1:
+            result.append(group[0])
+            continue
+        combined = copy.copy(group[0])
+        if isinstance(combined, RelationshipSet):
+            combined.relationships = [r for object_set in group for r in object_set.relationships]
+        else:
+            combined.nodes = [n for object_set in group for n in object_set.nodes]
+        log.debug("Combine %d sets to %s", len(group), combined)
+        result.append(combined)
+    return result
+
+
+def _split_object_set(object_set, batch_size: int = None) -> list:
+    """
+    Split a NodeSet/RelationshipSet into sets with one batch each. The batches can be sent
+    concurrently instead of waiting for the result of each batch.
+
+    Sets with nodes/relationships which are not a list are not split. The original set is not changed.
+
+    :param object_set: NodeSet or RelationshipSet.
+    :param batch_size: Batch size, the batch size of the set if not set.
+    :return: List of NodeSets/RelationshipSets.
+    """
+    data_key = 'relationships' if isinstance(object_set, RelationshipSet) else 'nodes'
+    objects = getattr(object_set, data_key)
+    batch_size = batch_size or object_set.batch_size
+    if not isinstance(objects, list) or len(objects) <= batch_size:
+        return [object_set]
+
+    parts = []
+    for i in range(0, len(objects), batch_size):
+        part = copy.copy(object_set)
+        setattr(part, data_key, objects[i:i + batch_size])
+        parts.append(part)
+    return parts
+
+
+def _bin_relationshipset(relset: RelationshipSet, bins: int) -> list:
+    """
+    Split a RelationshipSet into bins by the hash of the start node properties (see _merge_key()).
+    Relationships of different bins have different start nodes.
+
+    RelationshipSets with relationships which are not a list are not split. The original set is
+    not changed.
+
+    :param relset: The RelationshipSet.
+    :param bins: Number of bins.
+    :return: List of RelationshipSets, empty bins are left out.
+    """
+    if bins < 2 or not isinstance(relset.relationships, list):
+        return [relset]
+
+    keys = relset.start_node_properties
+    binned = [[] for _ in range(bins)]
+    for relationship in relset.relationships:
+        start_node_properties = relationship[0]
+        binned[hash(_merge_key(start_node_properties, keys)) % bins].append(relationship)
+
+    result = []
+    for relationships in binned:
+        if relationships:
+            part = copy.copy(relset)
+            part.relationships = relationships
+            result.append(part)
+    return result
+
+
+def _retry_transient(load, retries: int = MERGE_RETRIES, delay: float = MERGE_RETRY_DELAY):
+    """
+    Wrap a load(object_set, graph) function, rerun it after transient errors (e.g. deadlocks).
+    Only for idempotent loads (MERGE).
+
+    Waits with jittered exponential backoff before each retry, concurrent loads which deadlocked
+    do not start again at the same time.
+    """
+    def retry_load(object_set, graph):
+        for attempt in range(retries + 1):
+            try:
+                return load(object_set, graph)
+            except (TransientError, DriverTransientError):
+                if attempt == retries:
+                    raise
+                wait = delay * 2 ** attempt + random.random() * delay
+                log.warning("Transient error when loading %s, retry %d of %d in %.1fs",
+                            object_set, attempt + 1, retries, wait)
+                time.sleep(wait)
+    return retry_load
+
+
+def _write_buffered_relationshipset(relset: RelationshipSet, tmp_dir: str) -> str:
+    """
+    Write a RelationshipSet to a temporary file. Pickled instead of JSON to keep the types of the
+    properties (e.g. dates) and the batch size of the set.
+
+    :param relset: The RelationshipSet.
+    :param tmp_dir: Directory for the file.
+    :return: Path of the file.
+    """
+    path = os.path.join(tmp_dir, relset.object_file_name(suffix='.pickle'))
+    with open(path, 'wb') as f:
+        pickle.dump(relset, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_buffered_relationshipsets(buffered_relset_paths: list):
+    """
+    Read buffered RelationshipSets from disk. The next file is read in a background thread while
+    the current RelationshipSet is loaded, files are removed after they were read.
+
+    :param buffered_relset_paths: List of paths of the buffered RelationshipSets.
+    :return: Generator of RelationshipSets.
+    """
+    def read(path):
+        with open(path, 'rb') as f:
+            relset = pickle.load(f)
+        os.remove(path)
+        return relset
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_relset = None
+        for i, path in enumerate(buffered_relset_paths):
+            relset = next_relset.result() if next_relset else read(path)
+            if i + 1 < len(buffered_relset_paths):
+                next_relset = executor.submit(read, buffered_relset_paths[i + 1])
+            yield relset
+
+
+def _pool_chunksize(n_tasks: int, pool_size: int, chunksize: int = None) -> int:
+    """
+    Number of tasks sent to a worker process at once. By default each worker gets about four
+    chunks (like Pool.map) so that many small parsers do not pay the IPC overhead per task.
+
+    :param n_tasks: Number of tasks.
+    :param pool_size: Number of worker processes.
+    :param chunksize: Explicit chunk size, used if passed.
+    :return: The chunk size.
+    """
+    if chunksize:
+        return chunksize
+    return max(1, n_tasks // (4 * pool_size))
+
+
+def _deserialize_parser(source_dir: str) -> Parser:
+    """
+    Deserialize a Parser in a worker process.
+
+    :param source_dir: Directory of the serialized Parser.
+    :return: The Parser.
+    """
+    return Parser.deserialize(source_dir)
+
+
+def _run_task(task: tuple) -> str:
+    """
+    Run a pool task (function, args) and return the parser class name for logging.
+
+    The functions get the parser class name as second argument.
+    """
+    function, args = task
+    function(*args)
+    return args[1]
+
+
+def _run_tasks(tasks: list) -> List[str]:
+    """
+    Run a chunk of pool tasks in one worker call.
+
+    :param tasks: List of (function, args) tasks.
+    :return: List of parser class names.
+    """
+    return [_run_task(task) for task in tasks]
+
 
 class ParserSet:
     """
     A container for a set of Parser objects.
 
     Used to run batch operations: Merge all, export all to CSV etc.
+
+    Data can be loaded with a py2neo.Graph or a neo4j.Driver. The driver is shared by all threads,
+    run_and_merge_nodes_parallel() needs a py2neo.Graph to configure the worker processes.
+
+    The worker pool of the parallel runs is kept for the next run, use the ParserSet as context
+    manager or call close_pool() to stop the workers. A driver created with configure_driver() is
+    closed with the context manager as well.
     """
 
     def __init__(self):
         self.parsers = []
         self._parser_stash = []
 
+        # Graph and connection settings, see configure_connection()
+        self.graph = None
+        self._connection_settings = {}
+        # driver created by configure_driver(), closed in __exit__()
+        self._own_driver = None
+
+        # indexes created in the current load call, see _index_scope()
+        self._created_indexes = None
+
+        # worker pool, kept for repeated parallel runs
+        self._pool = None
+        self._pool_config = None
+
+    def configure_connection(self, uri: str, auth: tuple = None, name: str = None,
+                             max_connection_pool_size: int = 50) -> Graph:
+        """
+        Create a Graph with a sized Bolt connection pool and keep it as ParserSet.graph to pass it
+        to all operations. Threads and worker processes started by the ParserSet use the same pool size.
+
+        :param uri: URI of the database.
+        :param auth: Tuple of user and password.
+        :param name: Name of the graph (database).
+        :param max_connection_pool_size: Maximum number of Bolt connections.
+        :return: The Graph.
+        """
+        self._connection_settings = {'max_size': max_connection_pool_size}
+        self.graph = Graph(uri, name=name, auth=auth, **self._connection_settings)
+        return self.graph
+
+    def configure_driver(self, uri: str, auth: tuple = None, max_connection_pool_size: int = 50,
+                         connection_acquisition_timeout: float = 300) -> Driver:
+        """
+        Create a neo4j.Driver and keep it as ParserSet.graph to pass it to all operations. The driver
+        pools its connections and is shared by all threads. It is closed when the ParserSet is used
+        as context manager.
+
+        :param uri: URI of the database.
+        :param auth: Tuple of user and password.
+        :param max_connection_pool_size: Maximum number of Bolt connections.
+        :param connection_acquisition_timeout: Seconds to wait for a free connection of the pool.
+        :return: The driver.
+        """
+        self._connection_settings = {}
+        self.graph = GraphDatabase.driver(
+            uri, auth=auth, max_connection_pool_size=max_connection_pool_size,
+            connection_acquisition_timeout=connection_acquisition_timeout
+        )
+        self._own_driver = self.graph
+        return self.graph
+
     def add(self, parser: Parser):
         """
         Add a Parser to this ParserSet.
@@ -36,225 +539,689 @@ class ParserSet:
 
         :param parser: List of parsers.
         """
-        # select the parser that are passed
-        active_parsers = []
+        if all(isinstance(selection, str) for selection in parser):
+            self.select_by_name(parser)
+            return
+
+        # parsers by class name, the same class can be in the ParserSet multiple times
+        parsers_by_name = {}
+        for p in self.parsers:
+            parsers_by_name.setdefault(p.__class__.__name__, []).append(p)
+
+        # select the parser that are passed, keyed by id to keep each parser once
+        active_parsers = {}
         for selection in parser:
             if isinstance(selection, str):
-                for p in self.parsers:
-                    if p.__class__.__name__ == selection:
-                        active_parsers.append(p)
+                for p in parsers_by_name.get(selection, ()):
+                    active_parsers.setdefault(id(p), p)
             elif isinstance(selection, type):
                 for p in self.parsers:
                     if isinstance(p, selection):
-                        active_parsers.append(p)
+                        active_parsers.setdefault(id(p), p)
         # stash the others
         for p in self.parsers:
-            if p not in active_parsers:
+            if id(p) not in active_parsers:
                 self._parser_stash.append(p)
         # set list of active parsers
-        self.parsers = active_parsers
+        self.parsers = list(active_parsers.values())
 
-    def run_with_mounted_arguments(self):
+    def select_by_name(self, names: Iterable[str]):
         """
-        Run all parsers with mounted arguments.
+        Select parsers by class name, stash the others.
+
+        :param names: Class names of the parsers.
         """
+        names = list(dict.fromkeys(names))
+        wanted = set(names)
+
+        # the same class can be in the ParserSet multiple times
+        parsers_by_name = {}
         for p in self.parsers:
-            p.run_with_mounted_arguments()
+            parsers_by_name.setdefault(p.__class__.__name__, []).append(p)
+
+        self._parser_stash.extend(p for p in self.parsers if p.__class__.__name__ not in wanted)
+        self.parsers = [p for name in names for p in parsers_by_name.get(name, ())]
 
-    def merge(self, graph):
+    def run_with_mounted_arguments(self, max_workers: int = None):
+        """
+        Run all parsers with mounted arguments.
+
+        The parsers only collect data and do not depend on each other, with max_workers > 1 they run
+        concurrently in threads. This helps parsers which wait for I/O (e.g. reading files).
+
+        :param max_workers: Number of threads to run parsers concurrently.
+        """
+        if not max_workers or max_workers < 2 or len(self.parsers) < 2:
+            for p in self.parsers:
+                p.run_with_mounted_arguments()
+            return
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(self.parsers))) as executor:
+            futures = [executor.submit(p.run_with_mounted_arguments) for p in self.parsers]
+            for future in as_completed(futures):
+                # raise exceptions from the threads
+                future.result()
+
+    def merge(self, graph, batch_size: int = None, max_workers: int = None):
         """
         Fist merge all NodeSets, then merge all RelationshipSets in the ParserSet.
+
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param batch_size: Batch size for loading, default is the batch size of the NodeSet/RelationshipSet.
+        :param max_workers: Number of threads to load sets with different labels concurrently.
         """
-        self.merge_nodes(graph)
-        self.merge_relationships(graph)
+        with self._index_scope():
+            self.merge_nodes(graph, batch_size=batch_size, max_workers=max_workers)
+            self.merge_relationships(graph, batch_size=batch_size, max_workers=max_workers)
 
-    def merge_relationships(self, graph):
+    def merge_relationships(self, graph, batch_size: int = None, max_workers: int = None, bins: int = None):
+        """
+        Merge all RelationshipSets.
+
+        By default RelationshipSets with common labels are merged one after another. With bins > 1
+        (and max_workers > 1) each RelationshipSet is split into bins by start node (see
+        _bin_relationshipset()) and all bins are merged concurrently. Bins which fail with a
+        transient error (e.g. a deadlock on common end nodes) are merged again.
+
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param batch_size: Batch size.
+        :param max_workers: Maximum number of threads.
+        :param bins: Number of bins per RelationshipSet.
+        """
         log.debug("Merge relationships")
-        for p in self.parsers:
-            log.debug(f"Merge relationships for {p.__class__.__name__}")
-            for relset in p.container.relationshipsets:
-                log.debug(f"Merge {str(relset)}")
-                relset.create_index(graph)
-                relset.merge(graph)
+        nodesets, relsets = self._object_sets(skip_empty=True)
+        self._ensure_indexes(graph, nodesets, relsets)
+
+        def merge_relset(relset, graph):
+            log.debug("Merge %s", relset)
+            relset.merge(graph, batch_size=batch_size)
 
-    def merge_nodes(self, graph):
+        relsets = _combine_object_sets(relsets)
+        if bins and bins > 1 and max_workers and max_workers > 1:
+            relsets = [part for relset in relsets for part in _bin_relationshipset(relset, bins)]
+            _load_object_sets(graph, relsets, _retry_transient(merge_relset), max_workers, self._connection_settings,
+                              group_by_labels=False)
+        else:
+            _load_object_sets(graph, relsets, merge_relset, max_workers, self._connection_settings)
+
+    def merge_nodes(self, graph, batch_size: int = None, max_workers: int = None):
         log.debug("Merge nodes")
-        for p in self.parsers:
-            log.debug(f"Merge nodes for {p.__class__.__name__}")
-            for nodeset in p.container.nodesets:
-                log.debug(f"Merge {str(nodeset)}")
-                log.debug(f"Number of nodes: {len(nodeset.nodes)}")
-                nodeset.create_index(graph)
-                nodeset.merge(graph)
+        nodesets, relsets = self._object_sets(skip_empty=True)
+        self._ensure_indexes(graph, nodesets, relsets)
+
+        def merge_nodeset(nodeset, graph):
+            log.debug("Merge %s", nodeset)
+            log.debug("Number of nodes: %d", len(nodeset.nodes))
+            nodeset.merge(graph, batch_size=batch_size)
+
+        _load_object_sets(graph, _combine_object_sets(nodesets), merge_nodeset, max_workers, self._connection_settings)
 
-    def create(self, graph):
+    def merge_nodes_apoc(self, graph, batch_size: int = None, concurrency: int = 8):
+        """
+        Merge all NodeSets with apoc.periodic.iterate, the batches of a NodeSet are merged in parallel
+        on the server.
+
+        Nodes with the same merge key (also from different parsers) are combined into one row before
+        they are sent, parallel batches never merge the same node. The rows are sent in chunks of
+        APOC_MERGE_CHUNK_SIZE.
+
+        Falls back to merge_nodes() if APOC is not installed. NodeSets with preserve or append_props
+        and NodeSets with nodes from a generator are merged with NodeSet.merge().
+
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param batch_size: Batch size for apoc.periodic.iterate, default is the batch size of the NodeSet.
+        :param concurrency: Number of parallel batches.
+        :raises RuntimeError: If apoc.periodic.iterate reports failed batches, raised after all NodeSets are sent.
+        """
+        if not _apoc_available(graph):
+            log.warning("apoc.periodic.iterate not available, merge without APOC.")
+            self.merge_nodes(graph, batch_size=batch_size)
+            return
+
+        log.debug("Merge nodes with APOC")
+        nodesets, relsets = self._object_sets(skip_empty=True)
+        self._ensure_indexes(graph, nodesets, relsets)
+
+        failures = []
+        for nodeset in _combine_object_sets(nodesets):
+            # nodes from generators (YieldParser) are streamed in batches by NodeSet.merge() instead
+            # of sending all nodes at once
+            if not nodeset.merge_keys or getattr(nodeset, 'preserve', None) or getattr(nodeset, 'append_props', None) \
+                    or not isinstance(nodeset.nodes, list):
+                nodeset.merge(graph, batch_size=batch_size)
+                continue
+
+            log.debug("Merge %s", nodeset)
+            query = _apoc_merge_nodes_query(nodeset.labels, nodeset.merge_keys)
+            rows = _unique_node_rows(nodeset)
+            for i in range(0, len(rows), APOC_MERGE_CHUNK_SIZE):
+                result = run_query_return_results(
+                    graph, query, rows=rows[i:i + APOC_MERGE_CHUNK_SIZE],
+                    batch_size=batch_size or nodeset.batch_size, concurrency=concurrency
+                )
+                if result and result[0]['failedBatches']:
+                    log.error(f"Failed to merge {result[0]['failedBatches']} batches of {str(nodeset)}: "
+                              f"{result[0]['errorMessages']}")
+                    failures.append((str(nodeset), result[0]['failedBatches'], result[0]['errorMessages']))
+
+        if failures:
+            raise RuntimeError(
+                "apoc.periodic.iterate failed to merge batches: " + "; ".join(
+                    f"{nodeset}: {failed_batches} failed batches, {error_messages}"
+                    for nodeset, failed_batches, error_messages in failures
+                )
+            )
+
+    def create(self, graph, batch_size: int = None, max_workers: int = None):
         """
         Fist merge all NodeSets, then merge all RelationshipSets in the ParserSet.
+
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param batch_size: Batch size for loading, default is the batch size of the NodeSet/RelationshipSet.
+        :param max_workers: Number of threads to load sets with different labels concurrently.
         """
-        self.create_nodes(graph)
-        self.create_relationships(graph)
+        with self._index_scope():
+            self.create_nodes(graph, batch_size=batch_size, max_workers=max_workers)
+            self.create_relationships(graph, batch_size=batch_size, max_workers=max_workers)
 
-    def create_relationships(self, graph):
-        for p in self.parsers:
-            for relset in p.container.relationshipsets:
-                relset.create_index(graph)
-                relset.create(graph)
+    def create_relationships(self, graph, batch_size: int = None, max_workers: int = None):
+        nodesets, relsets = self._object_sets(skip_empty=True)
+        self._ensure_indexes(graph, nodesets, relsets)
+        _load_object_sets(
+            graph, _combine_object_sets(relsets),
+            lambda relset, graph: relset.create(graph, batch_size=batch_size), max_workers, self._connection_settings
+        )
 
-    def create_nodes(self, graph):
+    def create_nodes(self, graph, batch_size: int = None, max_workers: int = None):
+        nodesets, relsets = self._object_sets(skip_empty=True)
+        self._ensure_indexes(graph, nodesets, relsets)
+        nodesets = _combine_object_sets(nodesets)
+        if max_workers and max_workers > 1:
+            # CREATE does not lock existing nodes, all batches of all NodeSets are sent concurrently
+            # instead of waiting for the result of each batch
+            nodesets = [part for nodeset in nodesets for part in _split_object_set(nodeset, batch_size)]
+        _load_object_sets(
+            graph, nodesets,
+            lambda nodeset, graph: nodeset.create(graph, batch_size=batch_size), max_workers, self._connection_settings,
+            group_by_labels=False
+        )
+
+    def _object_sets(self, skip_empty: bool = False) -> tuple:
+        """
+        All NodeSets and all RelationshipSets of all parsers, collected in one pass over the parsers.
+
+        :param skip_empty: Leave out NodeSets/RelationshipSets without data.
+        :return: Tuple of the list of NodeSets and the list of RelationshipSets.
+        """
+        nodesets = []
+        relsets = []
         for p in self.parsers:
-            for nodeset in p.container.nodesets:
-                nodeset.create_index(graph)
-                nodeset.create(graph)
+            log.debug("Collect NodeSets and RelationshipSets of %s", p.__class__.__name__)
+            container = p.container
+            nodesets.extend(container.nodesets)
+            relsets.extend(container.relationshipsets)
+        if skip_empty:
+            nodesets = _skip_empty(nodesets)
+            relsets = _skip_empty(relsets)
+        return nodesets, relsets
 
     def _reset(self):
         for p in self.parsers:
             p._reset_parser()
 
-    def run_and_merge_nodes_parallel(self, graph: Graph, import_path: str, root_dir: str, pool_size=4):
-        log.debug(f"Run parallel, pool size {pool_size}")
-        graph_config = (graph.service.profile, graph.name)
-        pool = Pool(pool_size)
-        results = []
+    def _get_pool(self, pool_size: int, graph_config: tuple = None,
+                  max_connection_pool_size: int = None) -> ProcessPoolExecutor:
+        """
+        Get the worker pool of the ParserSet. A new pool is only created if there is none or if
+        the settings changed.
+
+        If a graph_config is passed, each worker keeps a Graph connected with this config.
+
+        :param pool_size: Number of worker processes.
+        :param graph_config: Tuple of graph profile and graph name.
+        :param max_connection_pool_size: Maximum number of Bolt connections per worker.
+        :return: The pool.
+        """
+        pool_config = (pool_size, graph_config, max_connection_pool_size)
+
+        if self._pool is not None:
+            # tasks which do not need a Graph can run in any pool with the right size
+            if pool_config == self._pool_config or (not graph_config and pool_size == self._pool_config[0]):
+                return self._pool
+            self.close_pool()
+
+        log.debug(f"Create pool, pool size {pool_size}")
+        if graph_config:
+            self._pool = ProcessPoolExecutor(pool_size, initializer=_init_worker,
+                                             initargs=(graph_config, max_connection_pool_size))
+        else:
+            self._pool = ProcessPoolExecutor(pool_size)
+        self._pool_config = pool_config
+
+        return self._pool
+
+    def close_pool(self):
+        """
+        Close the worker pool and wait for the workers to exit.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+            self._pool_config = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_pool()
+        if self._own_driver is not None:
+            self._own_driver.close()
+            self._own_driver = None
+
+    def _pool_tasks(self, function, first_arg, import_path: str, root_dir: str):
+        """
+        Generate a (function, args) pool task for each parser. The tasks are created while the pool
+        consumes them, DataSourceInstances shared by parsers are serialized once.
+
+        :param function: Module level function run in the worker.
+        :param first_arg: First argument of the function (e.g. graph config or target directory).
+        :param import_path: Path where to import the parsers from in the workers.
+        :param root_dir: Root directory of the DataSourceInstances.
+        """
+        dsi_dicts = {}
         for parser in self.parsers:
-            log.debug(f"Append {parser.__class__.__name__} to pool")
-            log.debug((graph_config, parser.__class__.__name__, import_path, parser.get_arguments(), [dsi.to_dict() for dsi in parser.datasource_instances], root_dir))
-            results.append(
-                pool.apply_async(
-                    run_parser_merge_nodes, (graph_config, parser.__class__.__name__, import_path, parser.get_arguments(), [dsi.to_dict() for dsi in parser.datasource_instances], root_dir)
-                )
+            args = (
+                first_arg, parser.__class__.__name__, import_path, parser.get_arguments(),
+                _datasource_instance_dicts(parser, dsi_dicts), root_dir
             )
-        log.debug("Wait for pool to close and join.")
-        [r.wait() for r in results]
+            log.debug("Append %s to pool: %s", args[1], args)
+            yield function, args
+
+    def _run_in_pool(self, pool: ProcessPoolExecutor, tasks, chunksize: int = 1):
+        """
+        Submit tasks to the pool in chunks and wait for them. The first error is raised as soon as
+        its chunk finishes, the chunks which did not start yet are cancelled.
+
+        :param pool: The pool.
+        :param tasks: Iterable of (function, args) tasks.
+        :param chunksize: Number of tasks per submitted chunk.
+        """
+        # future -> parser class names of the chunk, to report failed parsers
+        futures = {}
+        chunk = []
+        for task in tasks:
+            chunk.append(task)
+            if len(chunk) == chunksize:
+                futures[pool.submit(_run_tasks, chunk)] = [args[1] for _, args in chunk]
+                chunk = []
+        if chunk:
+            futures[pool.submit(_run_tasks, chunk)] = [args[1] for _, args in chunk]
 
-        pool.close()
-        pool.join()
+        log.debug("Wait for pool tasks to finish.")
+        try:
+            for future in as_completed(futures):
+                try:
+                    parser_class_names = future.result()
+                except Exception:
+                    log.error("Pool task failed for %s", ", ".join(futures[future]))
+                    raise
+                for parser_class_name in parser_class_names:
+                    log.debug("Finished %s", parser_class_name)
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for memory), the pool can not be reused
+            self.close_pool()
+            raise
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
 
-    def run_and_serialize_parallel(self, target_dir: str, import_path: str, root_dir: str, pool_size=4):
+    def run_and_merge_nodes_parallel(self, graph: Graph, import_path: str, root_dir: str, pool_size=4,
+                                     max_connection_pool_size: int = None, chunksize: int = None):
         log.debug(f"Run parallel, pool size {pool_size}")
+        graph_config = (graph.service.profile, graph.name)
+        if not max_connection_pool_size:
+            max_connection_pool_size = self._connection_settings.get('max_size')
+        pool = self._get_pool(pool_size, graph_config, max_connection_pool_size)
+
+        # the workers are initialized with the graph config, it is not sent with every task
+        tasks = self._pool_tasks(run_parser_merge_nodes, None, import_path, root_dir)
+        self._run_in_pool(pool, tasks, _pool_chunksize(len(self.parsers), pool_size, chunksize))
+
+    def run_and_serialize_parallel(self, target_dir: str, import_path: str, root_dir: str, pool_size=4,
+                                   chunksize: int = None):
+        log.debug(f"Run parallel, pool size {pool_size}")
+
+        pool = self._get_pool(pool_size)
+
+        tasks = self._pool_tasks(run_and_serialize, target_dir, import_path, root_dir)
+        self._run_in_pool(pool, tasks, _pool_chunksize(len(self.parsers), pool_size, chunksize))
+
+    def run_parallel_and_merge(self, graph: Union[Graph, Driver], target_dir: str, import_path: str, root_dir: str,
+                               pool_size=4, batch_size: int = None, max_workers: int = None):
+        """
+        Run all parsers in parallel worker processes, then merge the output from this process.
+
+        The parsers are serialized to the target directory by the workers and deserialized for
+        loading, the NodeSets/RelationshipSets are not sent between the processes. First all
+        NodeSets are merged, then all RelationshipSets.
 
-        pool = Pool(pool_size)
-        results = []
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param target_dir: Directory for the serialized parsers.
+        :param import_path: Path where to import the parsers from in the workers.
+        :param root_dir: Root directory of the DataSourceInstances.
+        :param pool_size: Number of worker processes.
+        :param batch_size: Batch size for loading, default is the batch size of the NodeSet/RelationshipSet.
+        :param max_workers: Number of threads to load sets with different labels concurrently.
+        """
+        self.run_and_serialize_parallel(target_dir, import_path, root_dir, pool_size=pool_size)
+
+        loaded = ParserSet()
+        loaded._connection_settings = self._connection_settings
         for parser in self.parsers:
-            log.debug(f"Append {parser.__class__.__name__} to pool")
-            log.debug((target_dir, parser.__class__.__name__, import_path, parser.get_arguments(), [dsi.to_dict() for dsi in parser.datasource_instances], root_dir))
-            results.append(
-                pool.apply_async(
-                    run_and_serialize, (target_dir, parser.__class__.__name__, import_path, parser.get_arguments(), [dsi.to_dict() for dsi in parser.datasource_instances], root_dir)
-                )
-            )
-        log.debug("Wait for pool to close and join.")
-        [r.wait() for r in results]
+            loaded.add(Parser.deserialize(os.path.join(target_dir, parser._serialization_dir_name())))
 
-        pool.close()
-        pool.join()
+        loaded.merge(graph, batch_size=batch_size, max_workers=max_workers)
 
-    def run_and_merge_relationships_sequential(self, graph: Graph):
+    def run_and_merge_relationships_sequential(self, graph: Graph, batch_size: int = None):
         """
         Merge NodeSets. Run again, merge RelationshipSets.
 
         This function is used when memory is limited to avoid collecting too much data in memroy.
         """
         # run again to create relationships
-        for parser in self.parsers:
-            parser.run_with_mounted_arguments()
-            for rs in parser.container.relationshipsets:
-                rs.merge(graph)
-            parser._reset_parser()
+        with self._index_scope():
+            for parser in self.parsers:
+                parser.run_with_mounted_arguments()
+                relsets = _skip_empty(parser.container.relationshipsets)
+                self._ensure_indexes(graph, [], relsets)
+                for rs in relsets:
+                    rs.merge(graph, batch_size=batch_size)
+                parser._reset_parser()
 
-    def run_and_merge_sequential(self, graph: Graph):
+    def run_and_merge_sequential(self, graph: Union[Graph, Driver], batch_size: int = None, buffer_dir: str = None):
         """
-        Merge NodeSets. Run again, merge RelationshipSets.
+        Run each parser once, merge its NodeSets and buffer its RelationshipSets on disk. Then merge
+        the buffered RelationshipSets.
 
         This function is used when memory is limited to avoid collecting too much data in memroy.
+
+        Parsers which yield relationships (no list of relationships) are run again to merge the
+        RelationshipSets instead of buffering.
+
+        The NodeSets of a parser are merged in a background thread while the next parser runs.
+
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param batch_size: Batch size for loading, default is the batch size of the NodeSet/RelationshipSet.
+        :param buffer_dir: Directory for the temporary RelationshipSet files, default is the system temp directory.
         """
         log.debug("Run and merge sequential.")
         log.debug("Merge NodeSets")
-        for parser in self.parsers:
-            log.debug(f"Run {parser.__class__.__name__}")
-            parser.run_with_mounted_arguments()
-            for ns in parser.container.nodesets:
-                log.debug(f"Merge NodeSet with {ns.labels}, {ns.merge_keys}")
-                ns.merge(graph)
-            parser._reset_parser()
+
+        # bounded, at most MERGE_QUEUE_SIZE parsers wait with their data in memory
+        parsers_to_merge = queue.Queue(maxsize=MERGE_QUEUE_SIZE)
+        errors = []
+
+        def merge_nodes_worker():
+            # py2neo Graphs are not thread-safe, the writer thread uses its own Graph
+            writer_graph = _thread_graph(graph, self._connection_settings)
+            while True:
+                parser = parsers_to_merge.get()
+                if parser is None:
+                    break
+                # keep draining the queue after an error so that the main thread is not blocked
+                try:
+                    if not errors:
+                        for ns in _skip_empty(parser.container.nodesets):
+                            log.debug("Merge NodeSet with %s, %s", ns.labels, ns.merge_keys)
+                            ns.merge(writer_graph, batch_size=batch_size)
+                    parser._reset_parser()
+                except Exception as e:
+                    errors.append(e)
+
+        writer = threading.Thread(target=merge_nodes_worker, daemon=True)
+        writer.start()
+
+        with tempfile.TemporaryDirectory(dir=buffer_dir) as tmp_dir:
+            buffered_relset_paths = []
+            rerun_parsers = []
+
+            try:
+                with self._index_scope():
+                    for parser in self.parsers:
+                        if errors:
+                            break
+                        log.debug("Run %s", parser.__class__.__name__)
+                        parser.run_with_mounted_arguments()
+                        # indexes are created before the writer thread merges the NodeSets
+                        self._ensure_indexes(
+                            graph, _skip_empty(parser.container.nodesets),
+                            _skip_empty(parser.container.relationshipsets)
+                        )
+                        self._buffer_relationshipsets(parser, tmp_dir, buffered_relset_paths, rerun_parsers)
+                        parsers_to_merge.put(parser)
+            finally:
+                parsers_to_merge.put(None)
+                writer.join()
+
+            if errors:
+                raise errors[0]
+
+            log.debug("Merge RelationshipSets")
+            for rs in _read_buffered_relationshipsets(buffered_relset_paths):
+                log.debug("Merge RelationshipSet %s", rs)
+                rs.merge(graph, batch_size=batch_size)
 
         # run again to create relationships
-        log.debug("Merge RelationshipSets")
-        for parser in self.parsers:
-            log.debug(f"Run {parser.__class__.__name__}")
+        for parser in rerun_parsers:
+            log.debug("Run %s", parser.__class__.__name__)
             parser.run_with_mounted_arguments()
-            for rs in parser.container.relationshipsets:
-                log.debug(f"Merge RelationshipSet {rs}")
-                rs.merge(graph)
+            for rs in _skip_empty(parser.container.relationshipsets):
+                log.debug("Merge RelationshipSet %s", rs)
+                rs.merge(graph, batch_size=batch_size)
             parser._reset_parser()
 
-    def create_index(self, graph:Graph):
+    async def run_and_merge_sequential_async(self, graph: Union[Graph, Driver], batch_size: int = None,
+                                             buffer_dir: str = None):
+        """
+        Run run_and_merge_sequential() in a thread of the event loop's executor, the event loop is
+        not blocked while the parsers run and the data is merged.
+
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param batch_size: Batch size for loading, default is the batch size of the NodeSet/RelationshipSet.
+        :param buffer_dir: Directory for the temporary RelationshipSet files, default is the system temp directory.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, functools.partial(self.run_and_merge_sequential, graph, batch_size=batch_size, buffer_dir=buffer_dir)
+        )
+
+    @staticmethod
+    def _buffer_relationshipsets(parser: Parser, tmp_dir: str, buffered_relset_paths: list, rerun_parsers: list):
+        """
+        Write the RelationshipSets of a parser to disk. Parsers which yield relationships are added to
+        the parsers that are run again instead.
+
+        :param parser: The parser.
+        :param tmp_dir: Directory for the RelationshipSet files.
+        :param buffered_relset_paths: List of paths of the buffered RelationshipSets.
+        :param rerun_parsers: List of parsers that are run again.
+        """
+        relsets = _skip_empty(parser.container.relationshipsets)
+        if all(isinstance(rs.relationships, list) for rs in relsets):
+            for rs in relsets:
+                log.debug("Buffer RelationshipSet %s", rs)
+                buffered_relset_paths.append(_write_buffered_relationshipset(rs, tmp_dir))
+        else:
+            rerun_parsers.append(parser)
+
+    def create_index(self, graph: Union[Graph, Driver]):
         """
         Create all indices.
 
-        :param graph: py2neo.Graph
+        :param graph: py2neo.Graph or neo4j.Driver
         """
-        for parser in self.parsers:
-            for ns in parser.container.nodesets:
-                ns.create_index(graph)
-            for rs in parser.container.relationshipsets:
-                rs.create_index(graph)
+        self.create_all_indexes(graph)
+
+    def create_all_indexes(self, graph: Union[Graph, Driver], skip_empty: bool = False):
+        """
+        Create the indexes of all NodeSets and RelationshipSets in the ParserSet.
+
+        NodeSets/RelationshipSets with the same index definition (labels and properties) are only
+        indexed once per call. A later call creates the indexes again, creating an existing index
+        does not change the database.
+
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param skip_empty: Do not create indexes for empty NodeSets/RelationshipSets.
+        """
+        nodesets, relsets = self._object_sets(skip_empty)
+        self._ensure_indexes(graph, nodesets, relsets)
+
+    @contextlib.contextmanager
+    def _index_scope(self):
+        """
+        Create each index only once during one load call (e.g. merge() with merge_nodes() and
+        merge_relationships()). The created indexes are forgotten afterwards, a later call creates
+        them again in case the database or its indexes were dropped in between.
+
+        Nested scopes use the outer scope.
+        """
+        if self._created_indexes is not None:
+            yield
+            return
+        self._created_indexes = set()
+        try:
+            yield
+        finally:
+            self._created_indexes = None
+
+    def _ensure_indexes(self, graph: Union[Graph, Driver], nodesets: list, relsets: list):
+        """
+        Create the indexes of NodeSets and RelationshipSets which were not created before in the
+        current load call, see _index_scope().
+
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param nodesets: List of NodeSets.
+        :param relsets: List of RelationshipSets.
+        """
+        graph_key = _graph_key(graph)
+
+        with self._index_scope():
+            for ns in nodesets:
+                index_key = (graph_key, 'nodeset', tuple(ns.labels), tuple(ns.merge_keys or ()))
+                if index_key not in self._created_indexes:
+                    ns.create_index(graph)
+                    self._created_indexes.add(index_key)
+            for rs in relsets:
+                index_key = (
+                    graph_key, 'relationshipset',
+                    tuple(rs.start_node_labels), tuple(rs.start_node_properties),
+                    tuple(rs.end_node_labels), tuple(rs.end_node_properties)
+                )
+                if index_key not in self._created_indexes:
+                    rs.create_index(graph)
+                    self._created_indexes.add(index_key)
 
-    def run_and_merge(self, graph: Graph):
+    def run_and_merge(self, graph: Union[Graph, Driver], batch_size: int = None, max_workers: int = None,
+                      run_max_workers: int = None):
         """
         Run all parser, merge all NodeSets, merge all RelationShip sets.
+
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param batch_size: Batch size for loading, default is the batch size of the NodeSet/RelationshipSet.
+        :param max_workers: Number of threads to load sets with different labels concurrently.
+        :param run_max_workers: Number of threads to run parsers concurrently.
         """
         self._reset()
-        self.run_with_mounted_arguments()
-        self.merge(graph)
+        self.run_with_mounted_arguments(max_workers=run_max_workers)
+        self.merge(graph, batch_size=batch_size, max_workers=max_workers)
 
-    def run_and_create(self, graph: Graph):
+    def run_and_create(self, graph: Union[Graph, Driver], batch_size: int = None, max_workers: int = None,
+                       run_max_workers: int = None):
         """
-        Run all parser, merge all NodeSets, merge all RelationShip sets.
+        Run all parser, create all NodeSets, create all RelationShip sets.
+
+        :param graph: py2neo.Graph or neo4j.Driver
+        :param batch_size: Batch size for loading, default is the batch size of the NodeSet/RelationshipSet.
+        :param max_workers: Number of threads to load sets with different labels concurrently.
+        :param run_max_workers: Number of threads to run parsers concurrently.
         """
         self._reset()
-        self.run_with_mounted_arguments()
-        self.create(graph)
+        self.run_with_mounted_arguments(max_workers=run_max_workers)
+        self.create(graph, batch_size=batch_size, max_workers=max_workers)
 
     def run_and_serialize(self, target_dir):
         for p in self.parsers:
             p.run_with_mounted_arguments()
             p.serialize(target_dir)
 
-    def serialize(self, target_dir: str) -> None:
+    def serialize(self, target_dir: str, max_workers: int = None, skip_unchanged: bool = False) -> None:
         """
         Serialize the entire ParserSet to a directory.
 
+        The parsers are serialized in threads. The file writes release the GIL, the JSON encoding
+        holds it but costs less than copying the data to worker processes would.
+
         :param target_dir: The target directory (must exist on disk)
+        :param max_workers: Number of threads, default is the number of CPUs. Use 1 to write in the current thread.
+        :param skip_unchanged: Do not rewrite parsers which did not change, see Parser.serialize().
         """
-        for p in self.parsers:
-            p.serialize(target_dir)
+        max_workers = min(max_workers or os.cpu_count() or 1, len(self.parsers))
+
+        if max_workers < 2:
+            for p in self.parsers:
+                p.serialize(target_dir, skip_unchanged=skip_unchanged)
+            return
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(p.serialize, target_dir, skip_unchanged=skip_unchanged) for p in self.parsers]
+            for future in as_completed(futures):
+                # raise exceptions from the threads
+                future.result()
 
     @classmethod
-    def deserialize(self, source_dir: str, whitelist: List[Union[str, type]] = None) -> 'ParserSet':
+    def deserialize(self, source_dir: str, whitelist: List[Union[str, type]] = None,
+                    max_workers: int = 1, processes: bool = False) -> 'ParserSet':
+        """
+        Read a serialized ParserSet. The parsers are read in the current thread by default.
+
+        With max_workers > 1 the parsers are read in threads. The file reads release the GIL, the
+        JSON decoding holds it. Worker processes (processes=True) decode in parallel but every parser
+        is pickled back to the parent, this only pays off for a few large parsers with little data.
+
+        :param source_dir: Directory to read from.
+        :param whitelist: Only read these parsers (names or classes).
+        :param max_workers: Number of threads (or processes), default is 1.
+        :param processes: Read the parsers in worker processes instead of threads.
+        :return: The ParserSet.
+        """
         log.debug(f"Read ParserSet from {source_dir}")
         ps = ParserSet()
-        parser_name_list = [x for x in os.listdir(source_dir) if not x.startswith('.')]
+        with os.scandir(source_dir) as entries:
+            parser_dirs = sorted(e.path for e in entries if not e.name.startswith('.'))
 
-        selected_parser_name_list = set()
+        if whitelist:
+            # select the parsers for the whitelist, only the metadata file is read
+            whitelisted_names = {x if isinstance(x, str) else x.__name__ for x in whitelist}
+            selected_parser_dirs = [
+                x for x in parser_dirs
+                if _load_json(os.path.join(x, PARSER_METADATA_FILE_NAME))['name'] in whitelisted_names
+            ]
+        else:
+            selected_parser_dirs = parser_dirs
 
-        # select the parser for whitelist
-        for parser_name in parser_name_list:
-            p_with_metadata = Parser.deserialize(os.path.join(source_dir, parser_name), metadata_only=True)
-            if whitelist:
-                for whitelisted_parser in whitelist:
+        max_workers = min(max_workers or 1, len(selected_parser_dirs))
 
-                    if isinstance(whitelisted_parser, str):
-                        if p_with_metadata.name == whitelisted_parser:
-                            selected_parser_name_list.add(parser_name)
-                    elif isinstance(whitelisted_parser, type):
-
-                        if whitelisted_parser.__name__ == p_with_metadata.name:
-                            selected_parser_name_list.add(parser_name)
-            else:
-                selected_parser_name_list.add(parser_name)
+        if max_workers < 2:
+            parsers = [Parser.deserialize(x) for x in selected_parser_dirs]
+        elif processes:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                parsers = list(executor.map(_deserialize_parser, selected_parser_dirs))
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                parsers = list(executor.map(Parser.deserialize, selected_parser_dirs))
 
-        for selected_parser in selected_parser_name_list:
-            p = Parser.deserialize(os.path.join(source_dir, selected_parser))
+        for p in parsers:
             ps.add(p)
 
         return ps
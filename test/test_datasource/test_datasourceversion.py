@@ -0,0 +1,26 @@
+import datetime
+
+from graphpipeline.datasource import DataSourceVersion
+from graphpipeline.datasource.helper.filehandler import _dirname_from_datetime, _datetime_from_dirname
+
+
+def test_datetime_dirname_roundtrip():
+    now = datetime.datetime(2021, 3, 4, 12, 30, 59, 123456)
+
+    dirname = _dirname_from_datetime(now)
+
+    assert ' ' not in dirname and ':' not in dirname and '.' not in dirname
+    assert _datetime_from_dirname(dirname) == now
+
+
+def test_datetime_from_legacy_dirname():
+    legacy_dirname = str(datetime.datetime(2021, 3, 4, 12, 30, 59, 123456)).replace(' ', '___').replace(':', '__').replace('.', '_')
+
+    assert _datetime_from_dirname(legacy_dirname) == datetime.datetime(2021, 3, 4, 12, 30, 59, 123456)
+
+
+def test_datetime_version_from_dirname():
+    now = datetime.datetime(2021, 3, 4, 12, 30, 59, 123456)
+    version = DataSourceVersion(now)
+
+    assert DataSourceVersion(version.dir_repr) == version
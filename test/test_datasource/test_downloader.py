@@ -0,0 +1,150 @@
+import datetime
+from ftplib import error_perm
+
+import pytest
+
+from graphpipeline.datasource.helper import downloader
+from graphpipeline.datasource.helper.downloader import retry
+
+
+class TestRetry:
+
+    @pytest.fixture(autouse=True)
+    def no_sleep(self, monkeypatch):
+        monkeypatch.setattr(downloader.time, 'sleep', lambda seconds: None)
+
+    def test_retry_until_success(self):
+        calls = []
+
+        @retry((EOFError,), tries=3)
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise EOFError
+            return 'done'
+
+        assert flaky() == 'done'
+        assert len(calls) == 3
+
+    def test_retry_raises_last_exception(self):
+        calls = []
+
+        @retry((EOFError,), tries=2)
+        def broken():
+            calls.append(1)
+            raise EOFError
+
+        with pytest.raises(EOFError):
+            broken()
+        assert len(calls) == 2
+
+    def test_no_retry_on_other_exceptions(self):
+        calls = []
+
+        @retry((EOFError,), tries=3)
+        def broken():
+            calls.append(1)
+            raise KeyError
+
+        with pytest.raises(KeyError):
+            broken()
+        assert len(calls) == 1
+
+
+class TestLatestDateFtpFile:
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        downloader._ftp_file_date_cache.clear()
+
+    def test_mdtm_result_is_cached(self, monkeypatch):
+        calls = []
+
+        def mdtm(url, file_name, path=None):
+            calls.append(file_name)
+            return datetime.date(2021, 3, 4)
+
+        monkeypatch.setattr(downloader, '_mdtm_date_ftp_file', mdtm)
+
+        assert downloader.latest_date_version_ftp_file('ftp.example.org', 'file.txt') == datetime.date(2021, 3, 4)
+        assert downloader.latest_date_version_ftp_file('ftp.example.org', 'file.txt') == datetime.date(2021, 3, 4)
+        assert len(calls) == 1
+
+    def test_fallback_to_listing(self, monkeypatch):
+        def mdtm(url, file_name, path=None):
+            raise error_perm('550 not a plain file')
+
+        monkeypatch.setattr(downloader, '_mdtm_date_ftp_file', mdtm)
+        monkeypatch.setattr(downloader, '_list_date_ftp_file', lambda url, file_name, path=None: datetime.date(2020, 1, 1))
+
+        assert downloader.latest_date_version_ftp_file('ftp.example.org', 'file.txt') == datetime.date(2020, 1, 1)
+
+
+class TestFtpConnection:
+
+    @pytest.fixture(autouse=True)
+    def no_sleep(self, monkeypatch):
+        monkeypatch.setattr(downloader.time, 'sleep', lambda seconds: None)
+
+    def test_connection_closed_on_failed_tries(self, monkeypatch, tmp_path):
+        connections = []
+
+        class FailingFTP:
+            def __init__(self, host):
+                self.closed = False
+                connections.append(self)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                self.closed = True
+
+            def login(self, **kwargs):
+                pass
+
+            def retrbinary(self, cmd, callback, blocksize=None):
+                raise EOFError
+
+        monkeypatch.setattr(downloader, '_TunedFTP', FailingFTP)
+
+        with pytest.raises(EOFError):
+            downloader._download_file_ftp('ftp://ftp.example.org/file.txt', str(tmp_path / 'file.txt'))
+        assert len(connections) == 3
+        assert all(ftp.closed for ftp in connections)
+
+
+class TestHttpResume:
+
+    class FakeResponse:
+        def __init__(self, status_code, headers=None, content=b''):
+            self.status_code = status_code
+            self.headers = headers or {}
+            self.content = content
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def iter_content(self, chunk_size=None):
+            yield self.content
+
+    def test_range_not_satisfiable_on_complete_file(self, monkeypatch, tmp_path):
+        path = tmp_path / 'file.txt'
+        path.write_bytes(b'12345')
+        monkeypatch.setattr(downloader._SESSION, 'get',
+                            lambda u, **kwargs: self.FakeResponse(416, {'Content-Range': 'bytes */5'}))
+
+        assert downloader._download_file_http_resume('http://example.org/file.txt', str(path)) == str(path)
+        assert path.read_bytes() == b'12345'
+
+    def test_range_not_satisfiable_on_other_size(self, monkeypatch, tmp_path):
+        path = tmp_path / 'file.txt'
+        path.write_bytes(b'12345')
+        monkeypatch.setattr(downloader._SESSION, 'get',
+                            lambda u, **kwargs: self.FakeResponse(416, {'Content-Range': 'bytes */3'}))
+
+        with pytest.raises(ValueError):
+            downloader._download_file_http_resume('http://example.org/file.txt', str(path))
@@ -0,0 +1,225 @@
+import io
+
+import pytest
+
+from graphpipeline.parser.embl import EMBLReaderUniProt, EMBL, split_records, _split_equal_sign_xref
+
+UNIPROT_RECORDS = """\
+ID   1433B_HUMAN             Reviewed;         246 AA.
+AC   P31946; A8K9K2;
+AC   E1P616;
+DT   01-JUL-1993, integrated into UniProtKB/Swiss-Prot.
+DE   RecName: Full=14-3-3 protein beta/alpha;
+DE   AltName: Full=Protein kinase C inhibitor protein 1;
+OS   Homo sapiens (Human).
+OC   Eukaryota; Metazoa; Chordata; Craniata; Vertebrata; Euteleostomi;
+OC   Mammalia; Eutheria.
+RN   [1]
+RP   NUCLEOTIDE SEQUENCE [MRNA] (ISOFORM SHORT).
+RX   PubMed=8515476; DOI=10.1016/0014-5793(93)80448-h;
+RA   Leffers H., Madsen P.;
+RT   "Molecular cloning and expression of the transformation sensitive
+RT   epithelial marker stratifin.";
+RL   FEBS Lett. 312:1-5(1993).
+RN   [2]
+RP   NUCLEOTIDE SEQUENCE.
+RC   TISSUE=Brain;
+RL   Submitted (JUN-1993) to the EMBL/GenBank/DDBJ databases.
+DR   EMBL; X57346; CAA40621.1; -; mRNA.
+DR   Ensembl; ENST00000353703; ENSP00000300161; ENSG00000166913. [P31946-1]
+DR   DNASU; 7529; -.
+SQ   SEQUENCE   246 AA;  28082 MW;  EB6C2E1A3C8F8D1A CRC64;
+     MTMDKSELVQ KAKLAEQAER YDDMAAAMKA VTEQGHELSN EERNLLSVAY KNVVGARRSS
+//
+ID   1433E_HUMAN             Reviewed;         255 AA.
+AC   P62258;
+DE   RecName: Full=14-3-3 protein epsilon;
+OS   Homo sapiens (Human).
+OC   Eukaryota.
+RN   [1]
+RX   PubMed=1234;
+RA   Doe J.;
+RT   "A title.";
+RL   J. Test 1:1-2(2000).
+DR   GeneID; 7531; -.
+SQ   SEQUENCE   255 AA;  29174 MW;  04A8BC4E5C3F1E3B CRC64;
+     MDDREDLVYQ AKLAEQAERY DEMVESMKKV AGMDVELTVE ERNLLSVAYK NVIGARRASW
+//
+"""
+
+EMBL_RECORD = """\
+ID   X56734; SV 1; linear; mRNA; STD; PLN; 1859 BP.
+XX
+AC   X56734; S46826;
+XX
+DE   Trifolium repens mRNA for non-cyanogenic beta-glucosidase
+XX
+OS   Trifolium repens (white clover)
+OC   Eukaryota; Viridiplantae.
+XX
+RN   [5]
+RX   DOI; 10.1007/BF00039495.
+RX   PUBMED; 1907511.
+RA   Oxtoby E., Dunn M.A.;
+RT   "Nucleotide and derived amino acid sequence of the cyanogenic
+RT   beta-glucosidase (linamarase) from white clover";
+RL   Plant Mol. Biol. 17(2):209-219(1991).
+XX
+DR   MD5; 1e51ca3a5450c43524b9185c236cc5cc.
+XX
+FH   Key             Location/Qualifiers
+FH
+FT   source          1..1859
+FT                   /organism="Trifolium repens"
+FT                   /mol_type="mRNA"
+FT                   /db_xref="taxon:3899"
+FT   CDS             join(14..200,
+FT                   300..1495)
+FT                   /product="beta-glucosidase"
+FT                   /db_xref="GOA:P26204"
+FT                   /translation="MDFLKGVSNKHPHLQVFLLLLLLAFIFSCNSMVS
+FT                   NLAPKWEGGF"
+XX
+SQ   Sequence 1859 BP; 609 A; 314 C; 355 G; 581 T; 0 other;
+     aaacaaacca aatatggatt ttattgtagc catatttgct ctgtttgtta ttagctcatt        60
+//
+"""
+
+
+@pytest.fixture
+def uniprot_file():
+    return io.StringIO(UNIPROT_RECORDS)
+
+
+@pytest.fixture
+def embl_file():
+    return io.StringIO(EMBL_RECORD)
+
+
+def test_split_records():
+    records = list(split_records(io.StringIO('ID   a\n//\nID   b\n//\n')))
+
+    assert records == ['ID   a', 'ID   b']
+
+
+@pytest.mark.parametrize('text', ['ID   a\n//  \nID   b\n//\n', 'ID   a\n//\r\nID   b\n// \t', 'ID   a\n//\nID   b\n//'])
+def test_split_records_terminator_with_trailing_blanks(text, monkeypatch):
+    from graphpipeline.parser import embl
+    for chunk_size in (3, 1 << 20):
+        monkeypatch.setattr(embl, 'READ_CHUNK_SIZE', chunk_size)
+        assert list(split_records(io.StringIO(text))) == ['ID   a', 'ID   b']
+
+
+def test_split_equal_sign_xref():
+    xrefs = _split_equal_sign_xref('PubMed=123; DOI=10.1/x y; Agricola=IND 1234; Other=a=b;')
+
+    assert xrefs == [('PubMed', '123'), ('DOI', '10.1/x y'), ('Agricola', 'IND 1234')]
+
+
+class TestUniProt:
+
+    def test_records(self, uniprot_file):
+        records = list(EMBLReaderUniProt(uniprot_file).records)
+
+        assert len(records) == 2
+        assert [r['ID'] for r in records] == ['1433B_HUMAN', '1433E_HUMAN']
+
+    def test_record_fields(self, uniprot_file):
+        record = next(EMBLReaderUniProt(uniprot_file).records)
+
+        assert record['AC'] == ['P31946', 'A8K9K2', 'E1P616']
+        assert record['OS'] == 'Homo sapiens (Human).'
+        assert record['OC'] == 'Eukaryota; Metazoa; Chordata; Craniata; Vertebrata; Euteleostomi; Mammalia; Eutheria.'
+        assert record['DE'] == 'RecName: Full=14-3-3 protein beta/alpha; AltName: Full=Protein kinase C inhibitor protein 1;'
+        assert record['DR'] == [
+            ('EMBL', ['X57346', 'CAA40621.1', '-', 'mRNA']),
+            ('Ensembl', ['ENST00000353703', 'ENSP00000300161', 'ENSG00000166913']),
+            ('DNASU', ['7529', '-'])
+        ]
+
+    def test_references(self, uniprot_file):
+        record = next(EMBLReaderUniProt(uniprot_file).records)
+
+        # only references with external xrefs (RX) are returned
+        assert len(record['references']) == 1
+        reference = record['references'][0]
+        assert reference['number'] == '1'
+        assert reference['xref'] == [('PubMed', '8515476'), ('DOI', '10.1016/0014-5793(93)80448-h')]
+        assert reference['author'] == 'Leffers H., Madsen P.;'
+        assert reference['title'] == '"Molecular cloning and expression of the transformation sensitive epithelial marker stratifin.";'
+        assert reference['reference'] == 'FEBS Lett. 312:1-5(1993).'
+
+    def test_record_count(self, uniprot_file):
+        container = EMBLReaderUniProt(uniprot_file)
+
+        assert container.record_count == 2
+        # file position is reset
+        assert len(list(container.records)) == 2
+
+    def test_record_count_file(self, tmp_path, monkeypatch):
+        from graphpipeline.parser import embl
+        monkeypatch.setattr(embl, 'READ_CHUNK_SIZE', 1)
+        path = tmp_path / 'uniprot.txt'
+        path.write_text(UNIPROT_RECORDS)
+
+        with open(path) as f:
+            container = EMBLReaderUniProt(f)
+            assert container.record_count == 2
+            assert len(list(container.records)) == 2
+
+    def test_records_small_chunks(self, uniprot_file, monkeypatch):
+        from graphpipeline.parser import embl
+        monkeypatch.setattr(embl, 'READ_CHUNK_SIZE', 7)
+
+        records = list(EMBLReaderUniProt(uniprot_file).records)
+
+        assert [r['ID'] for r in records] == ['1433B_HUMAN', '1433E_HUMAN']
+
+    def test_no_trailing_newline(self):
+        records = list(EMBLReaderUniProt(io.StringIO(UNIPROT_RECORDS.rstrip('\n'))).records)
+
+        assert [r['ID'] for r in records] == ['1433B_HUMAN', '1433E_HUMAN']
+
+    def test_missing_id_line(self):
+        record_text = '\n'.join(l for l in UNIPROT_RECORDS.split('\n') if not l.startswith('ID'))
+
+        records = list(EMBLReaderUniProt(io.StringIO(record_text)).records)
+
+        assert len(records) == 2
+        assert 'ID' not in records[0]
+        assert records[0]['AC'] == ['P31946', 'A8K9K2', 'E1P616']
+
+
+class TestEMBL:
+
+    def test_record(self, embl_file):
+        records = list(EMBL(embl_file).records)
+
+        assert len(records) == 1
+        record = records[0]
+        assert record['ID'] == 'X56734'
+        assert record['AC'] == ['X56734', 'S46826']
+        assert record['DE'] == 'Trifolium repens mRNA for non-cyanogenic beta-glucosidase'
+        assert record['references'][0]['number'] == '5'
+
+    def test_features(self, embl_file):
+        record = list(EMBL(embl_file).records)[0]
+
+        features = record['features']
+        assert [f['key'] for f in features] == ['source', 'CDS']
+        assert features[0]['location'] == '1..1859'
+        assert features[0]['qualifier'] == {'organism': 'Trifolium repens', 'mol_type': 'mRNA'}
+        assert features[0]['xref'] == [('taxon', '3899')]
+        assert features[1]['location'] == 'join(14..200,300..1495)'
+        assert features[1]['xref'] == [('GOA', 'P26204')]
+        assert features[1]['qualifier'] == {
+            'product': 'beta-glucosidase',
+            'translation': 'MDFLKGVSNKHPHLQVFLLLLLLAFIFSCNSMVSNLAPKWEGGF'
+        }
+
+    def test_no_features(self):
+        record_text = '\n'.join(l for l in EMBL_RECORD.split('\n') if not l.startswith('FT'))
+
+        record = list(EMBL(io.StringIO(record_text)).records)[0]
+
+        assert record['features'] == []
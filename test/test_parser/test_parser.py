@@ -1,10 +1,18 @@
+import datetime
+import json
 import pytest
 import os
 
 from graphpipeline.parser import ReturnParser, ParserSet, Parser
-from graphpipeline.parser.parser import YieldParser
+from graphpipeline.parser.parser import YieldParser, add_nodes, add_relationships, OBJECT_SET_FILE_SUFFIX
 from graphio import NodeSet, RelationshipSet
 
+# properties of all test relationships, shared because RelationshipSets do not change them
+REL_PROPS = {'source': 'test'}
+
+# ids of the test nodes
+IDS = tuple(range(100))
+
 
 class SomeParser(ReturnParser):
     def __init__(self):
@@ -18,10 +26,9 @@ class SomeParser(ReturnParser):
         self.run()
 
     def run(self):
-        for i in range(100):
-            self.source.add_node({'source_id': i})
-            self.target.add_node({'target_id': i})
-            self.rels.add_relationship({'source_id': i}, {'target_id': i}, {'source': 'test'})
+        add_nodes(self.source, ({'source_id': i} for i in IDS))
+        add_nodes(self.target, ({'target_id': i} for i in IDS))
+        add_relationships(self.rels, (({'source_id': i}, {'target_id': i}, REL_PROPS) for i in IDS))
 
 
 @pytest.fixture
@@ -51,11 +58,11 @@ class TestSerialization:
         assert os.path.exists(parser_path)
 
         for ns in tp.container.nodesets:
-            ns_file_path = os.path.join(parser_path, ns.object_file_name(suffix='.json'))
+            ns_file_path = os.path.join(parser_path, ns.object_file_name(suffix=OBJECT_SET_FILE_SUFFIX))
             assert os.path.exists(ns_file_path)
 
         for rs in tp.container.nodesets:
-            rs_file_path = os.path.join(parser_path, rs.object_file_name(suffix='.json'))
+            rs_file_path = os.path.join(parser_path, rs.object_file_name(suffix=OBJECT_SET_FILE_SUFFIX))
             assert os.path.exists(rs_file_path)
 
     def test_deserialize(self, tmp_path):
@@ -74,6 +81,84 @@ class TestSerialization:
         assert len(tp.container.nodesets) == len(reloaded_tp.container.nodesets)
         assert len(tp.container.relationshipsets) == len(reloaded_tp.container.relationshipsets)
 
+    @pytest.mark.parametrize('use_orjson', [True, False])
+    def test_deserialize_content(self, tmp_path, monkeypatch, use_orjson):
+        from graphpipeline.parser import parser
+        if not use_orjson:
+            monkeypatch.setattr(parser, 'orjson', None)
+        elif parser.orjson is None:
+            pytest.skip('orjson not installed')
+
+        tp = SomeParser()
+        tp.run()
+        tp.source.add_node({'source_id': 100, 'date': datetime.date(2020, 1, 2)})
+        tp.serialize(str(tmp_path))
+
+        reloaded_tp = Parser.deserialize(os.path.join(str(tmp_path), tp.name))
+
+        reloaded_source = reloaded_tp.get_nodeset(['Source'], ['source_id'])
+        assert len(reloaded_source.nodes) == 101
+        assert reloaded_source.nodes[-1] == {'source_id': 100, 'date': '2020-01-02'}
+        reloaded_rels = reloaded_tp.container.relationshipsets[0]
+        assert len(reloaded_rels.relationships) == 100
+
+    def test_object_set_file_chunks(self, tmp_path, monkeypatch):
+        from graphpipeline.parser import parser
+        monkeypatch.setattr(parser, 'SERIALIZE_CHUNK_SIZE', 30)
+
+        ns = NodeSet(['Source'], ['source_id'])
+        ns.nodes = ({'source_id': i} for i in IDS)
+        parser._write_object_set(ns, str(tmp_path))
+        rs = RelationshipSet('FOO', ['Source'], ['Target'], ['source_id'], ['target_id'])
+        rs.add_relationship({'source_id': 1}, {'target_id': 2}, {'foo': 'bar'})
+        parser._write_object_set(rs, str(tmp_path))
+
+        ns_path = os.path.join(str(tmp_path), ns.object_file_name(suffix=OBJECT_SET_FILE_SUFFIX))
+        with open(ns_path) as f:
+            lines = [json.loads(line) for line in f]
+        # header and 4 chunks
+        assert len(lines) == 5
+        assert lines[0] == {'labels': ['Source'], 'merge_keys': ['source_id']}
+
+        reloaded_ns = parser._read_object_set(ns_path, NodeSet)
+        assert reloaded_ns.labels == ['Source']
+        assert reloaded_ns.nodes == [{'source_id': i} for i in IDS]
+        reloaded_rs = parser._read_object_set(os.path.join(str(tmp_path), rs.object_file_name(suffix=OBJECT_SET_FILE_SUFFIX)), RelationshipSet)
+        assert reloaded_rs.relationships == [({'source_id': 1}, {'target_id': 2}, {'foo': 'bar'})]
+
+    def test_read_single_document_object_set(self, tmp_path):
+        from graphpipeline.parser import parser
+        ns = NodeSet(['Source'], ['source_id'])
+        ns.add_node({'source_id': 1})
+        path = os.path.join(str(tmp_path), ns.object_file_name(suffix='.json'))
+        with open(path, 'wt') as f:
+            json.dump(ns.to_dict(), f, indent=2)
+
+        reloaded_ns = parser._read_object_set(path, NodeSet)
+        assert reloaded_ns.nodes == [{'source_id': 1}]
+
+        # legacy files in a serialized Parser directory are read as well
+        with open(os.path.join(str(tmp_path), parser.PARSER_METADATA_FILE_NAME), 'wt') as f:
+            json.dump({'name': 'SomeParser'}, f)
+        reloaded_tp = Parser.deserialize(str(tmp_path))
+        assert getattr(reloaded_tp, ns.object_file_name()).nodes == [{'source_id': 1}]
+
+    def test_serialize_skip_unchanged(self, tmp_path):
+        tp = SomeParser()
+        tp.run()
+        tp.serialize(str(tmp_path), skip_unchanged=True)
+
+        ns_path = os.path.join(str(tmp_path), tp.name, tp.source.object_file_name(suffix=OBJECT_SET_FILE_SUFFIX))
+        os.utime(ns_path, (0, 0))
+        tp.serialize(str(tmp_path), skip_unchanged=True)
+        assert os.path.getmtime(ns_path) == 0
+
+        tp.source.add_node({'source_id': 100})
+        tp.serialize(str(tmp_path), skip_unchanged=True)
+        assert os.path.getmtime(ns_path) != 0
+        reloaded_tp = Parser.deserialize(os.path.join(str(tmp_path), tp.name))
+        assert len(reloaded_tp.get_nodeset(['Source'], ['source_id']).nodes) == 101
+
     def test_overwrite(self, tmp_path):
         tp = SomeParser()
         tp.run()
@@ -102,6 +187,17 @@ class TestSerialization:
 
         assert os.path.exists(os.path.join(tmp_path, 'test.txt'))
 
+def test_run_and_serialize_registers_object_set_arguments(tmp_path):
+    from graphpipeline.parser.parser import run_and_serialize
+    extra = NodeSet(['Extra'], merge_keys=['extra_id'])
+    extra.add_node({'extra_id': 1})
+
+    run_and_serialize(str(tmp_path), 'SomeParser', SomeParser.__module__, {'extra': extra}, [], str(tmp_path))
+
+    reloaded_tp = Parser.deserialize(os.path.join(str(tmp_path), 'SomeParser'))
+    assert reloaded_tp.get_nodeset(['Extra'], ['extra_id']).nodes == [{'extra_id': 1}]
+
+
 def test_parser_arguments():
     p = ReturnParser()
     p.arguments = ['foo', 'bar']
@@ -120,28 +216,81 @@ def test_parser_container(test_parser_with_data):
         assert isinstance(relset, RelationshipSet)
 
 
+def test_parser_container_cached(test_parser_with_data):
+    container = test_parser_with_data.container
+    assert test_parser_with_data.container is container
 
-class TestYieldParser:
+    test_parser_with_data.other = NodeSet(['Other'], merge_keys=['other_id'])
 
-    @pytest.fixture(scope='class')
-    def SimpleTestYieldParser(self):
-        class SimpleTestYieldParser(YieldParser):
+    assert test_parser_with_data.container is not container
+    assert len(test_parser_with_data.container.nodesets) == 3
+
+    test_parser_with_data.other = None
+
+    assert len(test_parser_with_data.container.nodesets) == 2
+
+    del test_parser_with_data.source
+
+    assert test_parser_with_data.container.nodesets == [test_parser_with_data.target]
+
+
+def test_reset_parser(test_parser_with_data):
+    container = test_parser_with_data.container
+
+    test_parser_with_data._reset_parser()
 
-            def __init__(self):
-                super(SimpleTestYieldParser, self).__init__()
+    assert test_parser_with_data.container is container
 
-                self.source = NodeSet(['YieldSource'], merge_keys=['uid'])
+    assert test_parser_with_data.source.nodes == []
+    assert test_parser_with_data.target.nodes == []
+    assert test_parser_with_data.rels.relationships == []
 
-            def run_with_mounted_arguments(self):
-                self.run()
 
-            def run(self):
-                self.source.nodes = self.yield_node_function()
+def test_parser_merge_creates_indexes_first(test_parser_with_data, monkeypatch):
+    calls = []
+    for cls in (NodeSet, RelationshipSet):
+        monkeypatch.setattr(cls, 'create_index', lambda self, graph: calls.append('index'))
+        monkeypatch.setattr(cls, 'merge', lambda self, graph, batch_size=None: calls.append('merge'))
 
-            def yield_node_function(self):
-                for i in range(100):
-                    yield {'uid': i}
+    test_parser_with_data.merge(None)
 
+    assert calls == ['index'] * 3 + ['merge'] * 3
+
+
+def test_parser_merge_skips_empty_sets(monkeypatch):
+    calls = []
+    for cls in (NodeSet, RelationshipSet):
+        monkeypatch.setattr(cls, 'create_index', lambda self, graph: calls.append('index'))
+        monkeypatch.setattr(cls, 'merge', lambda self, graph, batch_size=None: calls.append('merge'))
+
+    p = SomeParser()
+    p.merge(None)
+
+    assert calls == []
+
+
+class SimpleTestYieldParser(YieldParser):
+
+    def __init__(self):
+        super(SimpleTestYieldParser, self).__init__()
+
+        self.source = NodeSet(['YieldSource'], merge_keys=['uid'])
+
+    def run_with_mounted_arguments(self):
+        self.run()
+
+    def run(self):
+        self.source.nodes = self.yield_node_function()
+
+    def yield_node_function(self):
+        for i in IDS:
+            yield {'uid': i}
+
+
+class TestYieldParser:
+
+    @pytest.fixture(scope='class')
+    def SimpleTestYieldParser(self):
         return SimpleTestYieldParser
 
     @pytest.mark.neo4j
@@ -175,4 +324,18 @@ class TestYieldParser:
         yield_parser.create(graph)
 
         result = graph.run("MATCH (n:YieldSource) RETURN count(distinct n) AS count").data()
-        assert result[0]['count'] == 200
\ No newline at end of file
+        assert result[0]['count'] == 200
+
+
+def test_add_nodes_and_relationships():
+    ns = NodeSet(['Source'], merge_keys=['source_id'])
+    default_ns = NodeSet(['Source'], merge_keys=['source_id'], default_props={'taxid': 9606})
+    rs = RelationshipSet('FOO', ['Source'], ['Target'], ['source_id'], ['target_id'])
+
+    add_nodes(ns, ({'source_id': i} for i in range(3)))
+    add_nodes(default_ns, ({'source_id': i} for i in range(3)))
+    add_relationships(rs, (({'source_id': i}, {'target_id': i}, None) for i in range(3)))
+
+    assert ns.nodes == [{'source_id': 0}, {'source_id': 1}, {'source_id': 2}]
+    assert default_ns.nodes[0] == {'taxid': 9606, 'source_id': 0}
+    assert rs.relationships[2] == ({'source_id': 2}, {'target_id': 2}, {})
@@ -1,8 +1,83 @@
+import asyncio
+import datetime
+import threading
+import time
+from collections import namedtuple
+
 import pytest
 
 from graphpipeline.parser import ReturnParser,ParserSet
+from graphpipeline.parser import parserset
+from graphpipeline.parser.parser import YieldParser, add_nodes, add_relationships
 from graphio import NodeSet, RelationshipSet
 
+# properties of all test relationships, shared because RelationshipSets do not change them
+REL_PROPS = {'source': 'test'}
+
+# ids of the test nodes
+IDS = tuple(range(100))
+
+
+class FakeGraph:
+    class service:
+        profile = 'bolt://localhost:7687'
+    name = 'neo4j'
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+# a NodeSet/RelationshipSet passed to a patched create_index/merge/create, size at the time of the call
+Load = namedtuple('Load', ['name', 'size', 'graph', 'object_set'])
+
+
+def _load(object_set, graph) -> Load:
+    if isinstance(object_set, RelationshipSet):
+        name, rows = object_set.rel_type, object_set.relationships
+    else:
+        name, rows = object_set.labels[0], object_set.nodes
+    # generators have no size
+    return Load(name, len(rows) if isinstance(rows, list) else None, graph, object_set)
+
+
+class FakeDatabase:
+    """
+    Records the indexes, merges and creates of NodeSets/RelationshipSets instead of running queries.
+    """
+
+    def __init__(self):
+        self.indexes = []
+        self.merged = []
+        self.created = []
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """
+    Patch py2neo.Graph of the ParserSet threads with FakeGraph and record create_index(), merge()
+    and create() of all NodeSets/RelationshipSets in a FakeDatabase.
+    """
+    db = FakeDatabase()
+    monkeypatch.setattr(parserset, 'Graph', FakeGraph)
+    for object_set_class in (NodeSet, RelationshipSet):
+        monkeypatch.setattr(object_set_class, 'create_index', lambda self, graph: db.indexes.append(_load(self, graph)))
+        monkeypatch.setattr(object_set_class, 'merge',
+                            lambda self, graph, batch_size=None: db.merged.append(_load(self, graph)))
+        monkeypatch.setattr(object_set_class, 'create',
+                            lambda self, graph, batch_size=None: db.created.append(_load(self, graph)))
+    return db
+
+
+# counts of Source and Target nodes and FOO relationships in one round-trip
+COUNTS_QUERY = (
+    "OPTIONAL MATCH (s:Source) WITH count(distinct s) AS sources "
+    "OPTIONAL MATCH (t:Target) WITH sources, count(distinct t) AS targets "
+    "OPTIONAL MATCH (:Source)-[r:FOO]->(:Target) RETURN sources, targets, count(distinct r) AS rels"
+)
+
+
+def graph_counts(graph) -> dict:
+    return graph.run(COUNTS_QUERY).data()[0]
 
 
 class SomeTestParser(ReturnParser):
@@ -17,10 +92,26 @@ class SomeTestParser(ReturnParser):
         self.run()
 
     def run(self):
-        for i in range(100):
-            self.source.add_node({'source_id': i})
-            self.target.add_node({'target_id': i})
-            self.rels.add_relationship({'source_id': i}, {'target_id': i}, {'source': 'test'})
+        add_nodes(self.source, ({'source_id': i} for i in IDS))
+        add_nodes(self.target, ({'target_id': i} for i in IDS))
+        add_relationships(self.rels, (({'source_id': i}, {'target_id': i}, REL_PROPS) for i in IDS))
+
+
+class YieldTestParser(YieldParser):
+    def __init__(self):
+        super(YieldTestParser, self).__init__()
+
+        self.source = NodeSet(['Source'], merge_keys=['source_id'])
+        self.target = NodeSet(['Target'], merge_keys=['target_id'])
+        self.rels = RelationshipSet('FOO', ['Source'], ['Target'], ['source_id'], ['target_id'])
+
+    def run_with_mounted_arguments(self):
+        self.run()
+
+    def run(self):
+        self.source.nodes = ({'source_id': i} for i in IDS)
+        self.target.nodes = ({'target_id': i} for i in IDS)
+        self.rels.relationships = (({'source_id': i}, {'target_id': i}, REL_PROPS) for i in IDS)
 
 
 class RootTestParser(ReturnParser):
@@ -34,9 +125,8 @@ class RootTestParser(ReturnParser):
         self.run()
 
     def run(self):
-        for i in range(100):
-            self.source.add_node({'source_id': i})
-            self.target.add_node({'target_id': i})
+        add_nodes(self.source, ({'source_id': i} for i in IDS))
+        add_nodes(self.target, ({'target_id': i} for i in IDS))
 
 class DependingTestParser(ReturnParser):
 
@@ -48,8 +138,7 @@ class DependingTestParser(ReturnParser):
         self.run()
 
     def run(self):
-        for i in range(100):
-            self.rels.add_relationship({'source_id': i}, {'target_id': i}, {'source': 'test'})
+        add_relationships(self.rels, (({'source_id': i}, {'target_id': i}, REL_PROPS) for i in IDS))
 
 
 class SomeTestParserArguments(ReturnParser):
@@ -66,10 +155,9 @@ class SomeTestParserArguments(ReturnParser):
         self.run(self.taxid)
 
     def run(self, taxid):
-        for i in range(100):
-            self.source.add_node({'source_id': i})
-            self.target.add_node({'target_id': i})
-            self.rels.add_relationship({'source_id': i}, {'target_id': i}, {'source': 'test'})
+        add_nodes(self.source, ({'source_id': i} for i in IDS))
+        add_nodes(self.target, ({'target_id': i} for i in IDS))
+        add_relationships(self.rels, (({'source_id': i}, {'target_id': i}, REL_PROPS) for i in IDS))
 
 
 @pytest.mark.neo4j
@@ -83,25 +171,66 @@ def test_parserset_merge(clear_graph, tmp_path, graph):
 
     ps.run_and_merge(graph)
 
-    result = graph.run("MATCH (s:Source) RETURN count(distinct s) AS count").data()
-    assert result[0]['count'] == len(some_parser.source.nodes)
+    counts = graph_counts(graph)
+    assert counts['sources'] == len(some_parser.source.nodes)
+    assert counts['targets'] == len(some_parser.target.nodes)
+    assert counts['rels'] == len(some_parser.rels.relationships)
 
-    result = graph.run("MATCH (t:Target) RETURN count(distinct t) AS count").data()
-    assert result[0]['count'] == len(some_parser.target.nodes)
+    ps.run_and_merge(graph)
 
-    result = graph.run("MATCH (s:Source)-[r:FOO]->(t:Target) RETURN count(distinct r) AS count").data()
-    assert result[0]['count'] == len(some_parser.rels.relationships)
+    counts = graph_counts(graph)
+    assert counts['sources'] == len(some_parser.source.nodes)
+    assert counts['targets'] == len(some_parser.target.nodes)
+    assert counts['rels'] == len(some_parser.rels.relationships)
 
-    ps.run_and_merge(graph)
 
-    result = graph.run("MATCH (s:Source) RETURN count(distinct s) AS count").data()
-    assert result[0]['count'] == len(some_parser.source.nodes)
+@pytest.mark.neo4j
+def test_parserset_merge_threads(clear_graph, graph):
+    """
+    Merge overlapping parsers with threads (combined sets, one Graph per thread), merge again.
+    """
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.add(SomeTestParser())
+    ps.add(SomeTestParserArguments())
+    for p in ps.parsers:
+        p.taxid = '9606'
+    ps.run_with_mounted_arguments()
+
+    ps.merge(graph, max_workers=3)
+    ps.merge(graph, max_workers=3)
+
+    assert graph_counts(graph) == {'sources': 100, 'targets': 100, 'rels': 100}
+
+
+@pytest.mark.neo4j
+def test_parserset_merge_relationships_bins(clear_graph, graph):
+    """
+    Merge the relationships of overlapping parsers in concurrent bins.
+    """
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.add(SomeTestParser())
+    ps.run_with_mounted_arguments()
+
+    ps.merge_nodes(graph)
+    ps.merge_relationships(graph, max_workers=4, bins=4)
+    ps.merge_relationships(graph, max_workers=4, bins=4)
+
+    assert graph_counts(graph) == {'sources': 100, 'targets': 100, 'rels': 100}
+
+
+@pytest.mark.neo4j
+def test_parserset_run_parallel_and_merge(clear_graph, tmp_path, graph):
+    ps = ParserSet()
+    ps.add(SomeTestParser())
 
-    result = graph.run("MATCH (t:Target) RETURN count(distinct t) AS count").data()
-    assert result[0]['count'] == len(some_parser.target.nodes)
+    ps.run_parallel_and_merge(graph, str(tmp_path), SomeTestParser.__module__, str(tmp_path), pool_size=2)
+    ps.close_pool()
 
-    result = graph.run("MATCH (s:Source)-[r:FOO]->(t:Target) RETURN count(distinct r) AS count").data()
-    assert result[0]['count'] == len(some_parser.rels.relationships)
+    counts = graph_counts(graph)
+    assert counts['sources'] == 100
+    assert counts['rels'] == 100
 
 
 @pytest.mark.neo4j
@@ -120,27 +249,19 @@ def test_parserset_merge_sequential(clear_graph, tmp_path, graph):
     # run_and_merge_sequential resets the parser after running
     # run again to get the data for asserts
     ps.run_with_mounted_arguments()
-    result = graph.run("MATCH (s:Source) RETURN count(distinct s) AS count").data()
-    assert result[0]['count'] == len(root_parser.source.nodes)
-
-    result = graph.run("MATCH (t:Target) RETURN count(distinct t) AS count").data()
-    assert result[0]['count'] == len(root_parser.target.nodes)
-
-    result = graph.run("MATCH (s:Source)-[r:FOO]->(t:Target) RETURN count(distinct r) AS count").data()
-    assert result[0]['count'] == len(depending_parser.rels.relationships)
+    counts = graph_counts(graph)
+    assert counts['sources'] == len(root_parser.source.nodes)
+    assert counts['targets'] == len(root_parser.target.nodes)
+    assert counts['rels'] == len(depending_parser.rels.relationships)
 
     ps.run_and_merge_sequential(graph)
     # run_and_merge_sequential resets the parser after running
     # run again to get the data for asserts
     ps.run_with_mounted_arguments()
-    result = graph.run("MATCH (s:Source) RETURN count(distinct s) AS count").data()
-    assert result[0]['count'] == len(root_parser.source.nodes)
-
-    result = graph.run("MATCH (t:Target) RETURN count(distinct t) AS count").data()
-    assert result[0]['count'] == len(root_parser.target.nodes)
-
-    result = graph.run("MATCH (s:Source)-[r:FOO]->(t:Target) RETURN count(distinct r) AS count").data()
-    assert result[0]['count'] == len(depending_parser.rels.relationships)
+    counts = graph_counts(graph)
+    assert counts['sources'] == len(root_parser.source.nodes)
+    assert counts['targets'] == len(root_parser.target.nodes)
+    assert counts['rels'] == len(depending_parser.rels.relationships)
 
 
 
@@ -159,19 +280,15 @@ def test_parserset_create(clear_graph, tmp_path, graph):
 
     ps.run_and_create(graph)
 
-    result = graph.run("MATCH (s:Source) RETURN count(distinct s) AS count").data()
-    assert result[0]['count'] == len(some_parser.source.nodes)
-
-    result = graph.run("MATCH (t:Target) RETURN count(distinct t) AS count").data()
-    assert result[0]['count'] == len(some_parser.target.nodes)
+    counts = graph_counts(graph)
+    assert counts['sources'] == len(some_parser.source.nodes)
+    assert counts['targets'] == len(some_parser.target.nodes)
 
     ps.run_and_create(graph)
 
-    result = graph.run("MATCH (s:Source) RETURN count(distinct s) AS count").data()
-    assert result[0]['count'] == 2*len(some_parser.source.nodes)
-
-    result = graph.run("MATCH (t:Target) RETURN count(distinct t) AS count").data()
-    assert result[0]['count'] == 2*len(some_parser.target.nodes)
+    counts = graph_counts(graph)
+    assert counts['sources'] == 2*len(some_parser.source.nodes)
+    assert counts['targets'] == 2*len(some_parser.target.nodes)
 
 
 @pytest.mark.neo4j
@@ -188,25 +305,17 @@ def test_dependency_parserset_merge(clear_graph, graph):
 
     ps.run_and_merge(graph)
 
-    result = graph.run("MATCH (s:Source) RETURN count(distinct s) AS count").data()
-    assert result[0]['count'] == len(root_parser.source.nodes)
-
-    result = graph.run("MATCH (t:Target) RETURN count(distinct t) AS count").data()
-    assert result[0]['count'] == len(root_parser.target.nodes)
-
-    result = graph.run("MATCH (s:Source)-[r:FOO]->(t:Target) RETURN count(distinct r) AS count").data()
-    assert result[0]['count'] == len(depending_parser.rels.relationships)
+    counts = graph_counts(graph)
+    assert counts['sources'] == len(root_parser.source.nodes)
+    assert counts['targets'] == len(root_parser.target.nodes)
+    assert counts['rels'] == len(depending_parser.rels.relationships)
 
     ps.run_and_merge(graph)
 
-    result = graph.run("MATCH (s:Source) RETURN count(distinct s) AS count").data()
-    assert result[0]['count'] == len(root_parser.source.nodes)
-
-    result = graph.run("MATCH (t:Target) RETURN count(distinct t) AS count").data()
-    assert result[0]['count'] == len(root_parser.target.nodes)
-
-    result = graph.run("MATCH (s:Source)-[r:FOO]->(t:Target) RETURN count(distinct r) AS count").data()
-    assert result[0]['count'] == len(depending_parser.rels.relationships)
+    counts = graph_counts(graph)
+    assert counts['sources'] == len(root_parser.source.nodes)
+    assert counts['targets'] == len(root_parser.target.nodes)
+    assert counts['rels'] == len(depending_parser.rels.relationships)
 
 
 class TestParserSetSelection:
@@ -292,6 +401,36 @@ class TestParserSetSelection:
         assert p2 in ps._parser_stash
         assert p3 in ps.parsers
 
+    def test_parserset_select_by_name(self):
+        ps = ParserSet()
+        p1 = SomeTestParserArguments()
+        other_p1 = SomeTestParserArguments()
+        p2 = RootTestParser()
+        p3 = DependingTestParser()
+
+        ps.add(p1)
+        ps.add(p2)
+        ps.add(other_p1)
+        ps.add(p3)
+
+        ps.select_by_name(['DependingTestParser', 'SomeTestParserArguments', 'DependingTestParser'])
+
+        assert ps.parsers == [p3, p1, other_p1]
+        assert ps._parser_stash == [p2]
+
+    def test_parserset_selection_by_name_and_class(self):
+        ps = ParserSet()
+        p1 = SomeTestParser()
+        p2 = RootTestParser()
+
+        ps.add(p1)
+        ps.add(p2)
+
+        ps.select(parser=[SomeTestParser, p1.__class__.__name__])
+
+        assert ps.parsers == [p1]
+        assert ps._parser_stash == [p2]
+
 
 class TestParserSetSerialize:
 
@@ -359,3 +498,532 @@ class TestParserSetSerialize:
         assert p1.__class__.__name__ in [x.name for x in reloaded_ps.parsers]
         assert p3.__class__.__name__ in [x.name for x in reloaded_ps.parsers]
         assert p2.__class__.__name__ not in [x.name for x in reloaded_ps.parsers]
+
+    @pytest.mark.parametrize('max_workers, processes', [(1, False), (2, False), (2, True)])
+    def test_deserialize_content(self, tmp_path, max_workers, processes):
+        ps = ParserSet()
+        ps.add(SomeTestParser())
+        ps.add(RootTestParser())
+        ps.run_with_mounted_arguments()
+
+        ps.serialize(tmp_path, max_workers=max_workers)
+
+        reloaded_ps = ParserSet.deserialize(tmp_path, max_workers=max_workers, processes=processes)
+
+        assert sorted(x.name for x in reloaded_ps.parsers) == ['RootTestParser', 'SomeTestParser']
+        for p in reloaded_ps.parsers:
+            assert all(len(ns.nodes) == 100 for ns in p.container.nodesets)
+
+
+def test_parserset_pool_reused():
+    ps = ParserSet()
+
+    pool = ps._get_pool(2)
+    assert ps._get_pool(2) is pool
+
+    other_pool = ps._get_pool(1)
+    assert other_pool is not pool
+
+    ps.close_pool()
+    assert ps._pool is None
+
+
+def test_parserset_configure_driver():
+    from neo4j import Driver
+
+    # the driver connects lazily
+    with ParserSet() as ps:
+        driver = ps.configure_driver('bolt://localhost:7687', auth=('neo4j', 'test'), max_connection_pool_size=10)
+        assert isinstance(driver, Driver)
+        assert ps.graph is driver
+
+    assert ps._own_driver is None
+
+def test_parserset_context_closes_pool():
+    with ParserSet() as ps:
+        ps._get_pool(1)
+        assert ps._pool is not None
+
+    assert ps._pool is None
+
+
+class FailingTestParser(SomeTestParser):
+    def run(self):
+        raise ValueError("parser failed")
+
+
+def test_parserset_run_and_serialize_parallel(tmp_path):
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.add(RootTestParser())
+
+    ps.run_and_serialize_parallel(str(tmp_path), SomeTestParser.__module__, str(tmp_path), pool_size=2)
+    ps.close_pool()
+
+    reloaded_ps = ParserSet.deserialize(str(tmp_path), max_workers=1)
+    assert sorted(x.name for x in reloaded_ps.parsers) == ['RootTestParser', 'SomeTestParser']
+
+
+def test_parserset_run_and_serialize_parallel_raises(tmp_path, caplog):
+    ps = ParserSet()
+    ps.add(FailingTestParser())
+
+    with pytest.raises(ValueError):
+        ps.run_and_serialize_parallel(str(tmp_path), FailingTestParser.__module__, str(tmp_path), pool_size=2)
+    ps.close_pool()
+
+    assert "Pool task failed for FailingTestParser" in caplog.text
+
+
+def test_parserset_create_all_indexes_once(fake_db):
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.add(SomeTestParser())
+
+    ps.create_all_indexes(FakeGraph())
+    assert sorted(i.name for i in fake_db.indexes) == ['FOO', 'Source', 'Target']
+
+    # a later call creates the indexes again, e.g. after the database was dropped
+    ps.create_all_indexes(FakeGraph())
+    assert len(fake_db.indexes) == 6
+
+
+def test_parserset_merge_creates_indexes_once_per_call(fake_db):
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.add(SomeTestParser())
+    ps.run_with_mounted_arguments()
+
+    ps.merge(FakeGraph())
+    assert sorted(i.name for i in fake_db.indexes) == ['FOO', 'Source', 'Target']
+
+    ps.merge(FakeGraph())
+    assert sorted(i.name for i in fake_db.indexes) == ['FOO', 'FOO', 'Source', 'Source', 'Target', 'Target']
+
+
+def test_group_by_labels():
+    source = NodeSet(['Source'], merge_keys=['source_id'])
+    target = NodeSet(['Target'], merge_keys=['target_id'])
+    other = NodeSet(['Other'], merge_keys=['other_id'])
+    rels = RelationshipSet('FOO', ['Source'], ['Target'], ['source_id'], ['target_id'])
+
+    groups = parserset._group_by_labels([source, target, other, rels])
+
+    assert len(groups) == 2
+    assert [source, target, rels] in groups
+    assert [other] in groups
+
+
+def test_parserset_merge_nodes_threads(fake_db):
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.run_with_mounted_arguments()
+
+    ps.merge_nodes(FakeGraph(), max_workers=2)
+
+    assert sorted(m.name for m in fake_db.merged) == ['Source', 'Target']
+
+
+def test_parserset_run_and_merge_threads(fake_db):
+    graph = FakeGraph()
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+
+    ps.run_and_merge(graph, max_workers=2)
+
+    # the threads use their own Graphs
+    assert sorted((m.name, m.graph is graph) for m in fake_db.merged) == [('FOO', False), ('Source', False), ('Target', False)]
+
+
+def test_parserset_merge_skips_empty_sets(fake_db):
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+
+    ps.merge(FakeGraph())
+
+    assert fake_db.indexes == []
+    assert fake_db.merged == []
+
+
+def test_parserset_merge_sequential_runs_once(fake_db):
+    runs = []
+
+    class CountingTestParser(SomeTestParser):
+        def run(self):
+            runs.append(1)
+            super(CountingTestParser, self).run()
+
+    ps = ParserSet()
+    ps.add(CountingTestParser())
+
+    ps.run_and_merge_sequential(FakeGraph())
+
+    assert len(runs) == 1
+    assert [m.size for m in fake_db.merged] == [100, 100, 100]
+
+
+def test_parserset_merge_sequential_creates_indexes_once(fake_db):
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.add(SomeTestParser())
+
+    ps.run_and_merge_sequential(FakeGraph())
+
+    assert sorted(i.name for i in fake_db.indexes) == ['FOO', 'Source', 'Target']
+
+
+def test_parserset_merge_sequential_async(fake_db):
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+
+    asyncio.run(ps.run_and_merge_sequential_async(FakeGraph()))
+
+    assert [m.size for m in fake_db.merged] == [100, 100, 100]
+
+def test_parserset_merge_sequential_overlaps(fake_db, monkeypatch):
+    events = []
+
+    def slow_merge(self, graph, batch_size=None):
+        time.sleep(0.05)
+        events.append(('merge', len(self.nodes), threading.current_thread() is threading.main_thread()))
+
+    monkeypatch.setattr(NodeSet, 'merge', slow_merge)
+
+    class RecordingTestParser(SomeTestParser):
+        def run(self):
+            events.append(('run', self.__class__.__name__))
+            super(RecordingTestParser, self).run()
+
+    class OtherRecordingTestParser(RecordingTestParser):
+        pass
+
+    ps = ParserSet()
+    ps.add(RecordingTestParser())
+    ps.add(OtherRecordingTestParser())
+
+    ps.run_and_merge_sequential(FakeGraph())
+
+    # the second parser runs before the NodeSets of the first parser are merged
+    assert events[1] == ('run', 'OtherRecordingTestParser')
+    # nodes are merged in the writer thread
+    assert [e for e in events if e[0] == 'merge'] == [('merge', 100, False)] * 4
+
+
+def test_parserset_merge_sequential_raises_merge_error(fake_db, monkeypatch):
+    def failing_merge(self, graph, batch_size=None):
+        raise ValueError("merge failed")
+
+    monkeypatch.setattr(NodeSet, 'merge', failing_merge)
+
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+
+    with pytest.raises(ValueError):
+        ps.run_and_merge_sequential(FakeGraph())
+
+
+@pytest.mark.parametrize('number_of_parsers', [1, 2, parserset.MERGE_QUEUE_SIZE + 3])
+def test_parserset_merge_sequential_yield_parsers(fake_db, number_of_parsers):
+    ps = ParserSet()
+    for _ in range(number_of_parsers):
+        ps.add(YieldTestParser())
+
+    ps.run_and_merge_sequential(FakeGraph())
+
+    # NodeSets of every parser are merged, the RelationshipSets after running the parsers again
+    assert sorted(m.name for m in fake_db.merged) == sorted(['FOO', 'Source', 'Target'] * number_of_parsers)
+
+
+def test_parserset_merge_sequential_raises_reset_error(fake_db):
+    class FailingResetParser(SomeTestParser):
+        def _reset_parser(self):
+            raise RuntimeError("reset failed")
+
+    ps = ParserSet()
+    for _ in range(parserset.MERGE_QUEUE_SIZE + 3):
+        ps.add(FailingResetParser())
+
+    with pytest.raises(RuntimeError):
+        ps.run_and_merge_sequential(FakeGraph())
+
+
+def test_apoc_merge_nodes_query():
+    query = parserset._apoc_merge_nodes_query(['Source', 'Node'], ['source_id', 'version'])
+
+    assert "MERGE (n:Source:Node { source_id: row.source_id, version: row.version })" in query
+    assert "params: {rows: $rows}" in query
+    assert parserset._apoc_merge_nodes_query(['Source', 'Node'], ['source_id', 'version']) is query
+
+
+def test_parserset_merge_nodes_apoc_streams_generators(fake_db, monkeypatch):
+    queries = []
+    monkeypatch.setattr(parserset, '_apoc_available', lambda graph: True)
+    monkeypatch.setattr(parserset, 'run_query_return_results', lambda graph, query, **params: queries.append(query))
+
+    class GeneratorTestParser(RootTestParser):
+        def run(self):
+            super(GeneratorTestParser, self).run()
+            self.target.nodes = ({'target_id': i} for i in IDS)
+
+    ps = ParserSet()
+    ps.add(GeneratorTestParser())
+    ps.run_with_mounted_arguments()
+
+    ps.merge_nodes_apoc(FakeGraph())
+
+    assert len(queries) == 1
+    assert [m.name for m in fake_db.merged] == ['Target']
+
+
+def test_parserset_merge_nodes_apoc_unique_rows(fake_db, monkeypatch):
+    sent = []
+    monkeypatch.setattr(parserset, '_apoc_available', lambda graph: True)
+    monkeypatch.setattr(parserset, 'APOC_MERGE_CHUNK_SIZE', 30)
+    monkeypatch.setattr(parserset, 'run_query_return_results',
+                        lambda graph, query, rows=None, **params: sent.append((rows, params['batch_size'])))
+
+    first = RootTestParser()
+    second = RootTestParser()
+    ps = ParserSet()
+    ps.add(first)
+    ps.add(second)
+    ps.run_with_mounted_arguments()
+    second.source.nodes[0]['name'] = 'first'
+
+    ps.merge_nodes_apoc(FakeGraph())
+
+    source_rows = [row for rows, _ in sent for row in rows if 'source_id' in row]
+    assert sorted(row['source_id'] for row in source_rows) == list(IDS)
+    assert source_rows[0] == {'source_id': 0, 'name': 'first'}
+    assert max(len(rows) for rows, _ in sent) == 30
+    assert {batch_size for _, batch_size in sent} == {first.source.batch_size}
+    # the nodes of the parsers are not changed
+    assert first.source.nodes[0] == {'source_id': 0}
+
+
+def test_parserset_merge_nodes_apoc_failed_batches(fake_db, monkeypatch):
+    sent = []
+
+    def run_query(graph, query, rows=None, **params):
+        sent.append(rows)
+        return [{'failedBatches': 1, 'errorMessages': {'deadlock': 1}}]
+
+    monkeypatch.setattr(parserset, '_apoc_available', lambda graph: True)
+    monkeypatch.setattr(parserset, 'run_query_return_results', run_query)
+
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.run_with_mounted_arguments()
+
+    with pytest.raises(RuntimeError, match='deadlock'):
+        ps.merge_nodes_apoc(FakeGraph())
+
+    # the other NodeSets are still sent before raising
+    assert len(sent) == 2
+
+
+@pytest.mark.neo4j
+def test_parserset_merge_nodes_apoc_overlapping_parsers(clear_graph, graph):
+    """
+    Two parsers with the same nodes, the combined rows must not create duplicates in parallel batches.
+    """
+    if not parserset._apoc_available(graph):
+        pytest.skip('APOC not installed')
+
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.add(SomeTestParser())
+    ps.run_with_mounted_arguments()
+
+    ps.merge_nodes_apoc(graph, batch_size=10)
+
+    assert graph_counts(graph) == {'sources': 100, 'targets': 100, 'rels': 0}
+
+
+@pytest.mark.neo4j
+def test_parserset_merge_nodes_apoc(clear_graph, graph):
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.run_with_mounted_arguments()
+
+    ps.merge_nodes_apoc(graph)
+    ps.merge_nodes_apoc(graph)
+
+    result = graph.run("MATCH (s:Source) RETURN count(distinct s) AS count").data()
+    assert result[0]['count'] == 100
+
+
+def test_parserset_configure_connection(monkeypatch):
+    graphs = []
+
+    class FakeGraph:
+        def __init__(self, *args, **kwargs):
+            graphs.append((args, kwargs))
+
+    monkeypatch.setattr(parserset, 'Graph', FakeGraph)
+
+    ps = ParserSet()
+    graph = ps.configure_connection('bolt://localhost:7687', auth=('neo4j', 'test'), max_connection_pool_size=10)
+
+    assert ps.graph is graph
+    assert graphs[0][1]['max_size'] == 10
+    assert ps._connection_settings == {'max_size': 10}
+
+
+def test_pool_chunksize():
+    assert parserset._pool_chunksize(3, 4) == 1
+    assert parserset._pool_chunksize(160, 4) == 10
+    assert parserset._pool_chunksize(160, 4, chunksize=2) == 2
+
+
+def test_combine_object_sets():
+    p1 = SomeTestParser()
+    p2 = SomeTestParser()
+    p1.run()
+    p2.run()
+    other = NodeSet(['Source'], merge_keys=['other_id'])
+    other.add_node({'other_id': 1})
+
+    combined = parserset._combine_object_sets([p1.source, other, p2.source, p1.rels, p2.rels])
+
+    assert [len(x.nodes) if isinstance(x, NodeSet) else len(x.relationships) for x in combined] == [200, 1, 200]
+    assert combined[1] is other
+    # the original sets are not changed
+    assert len(p1.source.nodes) == 100
+    assert len(p1.rels.relationships) == 100
+
+
+def test_parserset_merge_combines_sets(fake_db):
+
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.add(SomeTestParser())
+    ps.run_with_mounted_arguments()
+
+    ps.merge(FakeGraph())
+
+    assert [m.size for m in fake_db.merged] == [200, 200, 200]
+
+
+def test_split_object_set():
+    ns = NodeSet(['Source'], ['source_id'], batch_size=30)
+    add_nodes(ns, ({'source_id': i} for i in IDS))
+
+    parts = parserset._split_object_set(ns)
+
+    assert [len(part.nodes) for part in parts] == [30, 30, 30, 10]
+    assert [n for part in parts for n in part.nodes] == ns.nodes
+    assert len(ns.nodes) == 100
+    assert parserset._split_object_set(ns, batch_size=100) == [ns]
+
+
+def test_parserset_create_nodes_sends_batches_concurrently(fake_db):
+
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.run_with_mounted_arguments()
+
+    ps.create_nodes(FakeGraph(), batch_size=40, max_workers=4)
+
+    assert sorted((c.name, c.size) for c in fake_db.created) == [('Source', 20), ('Source', 40), ('Source', 40),
+                                                              ('Target', 20), ('Target', 40), ('Target', 40)]
+
+
+def test_bin_relationshipset():
+    rs = RelationshipSet('FOO', ['Source'], ['Target'], ['source_id'], ['target_id'])
+    add_relationships(rs, (({'source_id': i % 10}, {'target_id': i}, REL_PROPS) for i in IDS))
+
+    bins = parserset._bin_relationshipset(rs, 4)
+
+    assert sum(len(part.relationships) for part in bins) == 100
+    start_nodes = [{r[0]['source_id'] for r in part.relationships} for part in bins]
+    for i, nodes in enumerate(start_nodes):
+        for other in start_nodes[i + 1:]:
+            assert not nodes & other
+    assert parserset._bin_relationshipset(rs, 1) == [rs]
+
+    # unhashable start node properties
+    rs = RelationshipSet('FOO', ['Source'], ['Target'], ['source_ids'], ['target_id'])
+    add_relationships(rs, (({'source_ids': [i, i + 1]}, {'target_id': i}, REL_PROPS) for i in IDS))
+    assert sum(len(part.relationships) for part in parserset._bin_relationshipset(rs, 4)) == 100
+
+
+def test_parserset_merge_relationships_bins_retry(fake_db, monkeypatch):
+    from py2neo import TransientError
+    waits = []
+    monkeypatch.setattr(parserset.time, 'sleep', waits.append)
+    merged = []
+    failed = []
+
+    def merge(self, graph, batch_size=None):
+        # first bin fails once
+        if not failed and 0 in {r[0]['source_id'] for r in self.relationships}:
+            failed.append(True)
+            raise TransientError('deadlock', 'Neo.TransientError.Transaction.DeadlockDetected')
+        merged.extend(self.relationships)
+
+    monkeypatch.setattr(RelationshipSet, 'merge', merge)
+
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.run_with_mounted_arguments()
+
+    ps.merge_relationships(FakeGraph(), max_workers=4, bins=4)
+
+    assert failed
+    assert len(waits) == 1 and parserset.MERGE_RETRY_DELAY <= waits[0] < 2 * parserset.MERGE_RETRY_DELAY
+    assert sorted(r[0]['source_id'] for r in merged) == list(IDS)
+
+
+def test_read_buffered_relationshipsets(tmp_path):
+    paths = []
+    for i in range(3):
+        rs = RelationshipSet('FOO', ['Source'], ['Target'], ['source_id'], ['target_id'], batch_size=i + 1)
+        for j in range(i + 1):
+            rs.add_relationship({'source_id': j}, {'target_id': j}, {'since': datetime.date(2020, 1, j + 1)})
+        paths.append(parserset._write_buffered_relationshipset(rs, str(tmp_path)))
+
+    result = list(parserset._read_buffered_relationshipsets(paths))
+
+    assert [(len(rs.relationships), rs.batch_size) for rs in result] == [(1, 1), (2, 2), (3, 3)]
+    # property types are kept
+    assert result[2].relationships[2] == ({'source_id': 2}, {'target_id': 2}, {'since': datetime.date(2020, 1, 3)})
+    assert not list(tmp_path.iterdir())
+
+
+def test_parserset_merge_with_driver(fake_db):
+    from neo4j import GraphDatabase
+
+    # the driver connects lazily
+    driver = GraphDatabase.driver('bolt://localhost:7687', auth=('neo4j', 'test'))
+
+    ps = ParserSet()
+    ps.add(SomeTestParser())
+    ps.run_with_mounted_arguments()
+
+    ps.merge(driver, max_workers=2)
+    ps.merge(driver, max_workers=2)
+
+    # 3 indexes and 3 sets per merge, the threads share the driver
+    used = fake_db.indexes + fake_db.merged
+    assert len(used) == 12
+    assert all(x.graph is driver for x in used)
+    driver.close()
+
+
+def test_parserset_run_parsers_threads():
+    # both parsers have to run at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    class WaitingTestParser(SomeTestParser):
+        def run(self):
+            barrier.wait()
+            super(WaitingTestParser, self).run()
+
+    ps = ParserSet()
+    ps.add(WaitingTestParser())
+    ps.add(WaitingTestParser())
+
+    ps.run_with_mounted_arguments(max_workers=2)
+
+    assert all(len(p.source.nodes) == 100 for p in ps.parsers)